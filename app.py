@@ -1,8 +1,10 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
+from flask import Response, stream_with_context
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timezone
 import os
 import re
 import sys
@@ -18,7 +20,22 @@ import random
 import time
 import urllib.request
 import urllib.error
+import urllib.parse
+import http.client
+import socket
+import ssl
+import io
+import threading
+import math
+import heapq
+import hashlib
+import bisect
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import click
+from sqlalchemy.exc import IntegrityError
 from flask import g
+from markupsafe import Markup, escape
 
 # Ensure UTF-8 console output on Windows to avoid UnicodeEncodeError when logging
 if hasattr(sys.stdout, "reconfigure"):
@@ -72,7 +89,22 @@ _load_dotenv(os.path.join(app.instance_path, '.env'))
 _load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
 db = SQLAlchemy(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', logger=False, engineio_logger=False)
+
+# Socket.IO fan-out between worker processes (SOCKETIO_MESSAGE_QUEUE):
+#   ''                  - single process, in-memory rooms (default)
+#   'sqlite' / 'sqlite:///path/bus.db' - shared SQLite bus for all workers on one host
+#   'redis://...' etc.  - any message queue supported by Flask-SocketIO
+_socketio_queue = (os.getenv('SOCKETIO_MESSAGE_QUEUE') or '').strip()
+_socketio_opts = {}
+if _socketio_queue.startswith('sqlite'):
+    from socket_bus import SQLiteBusManager
+    _bus_url = _socketio_queue if _socketio_queue.startswith('sqlite:///') else \
+        'sqlite:///' + os.path.join(app.instance_path, 'socketio_bus.db')
+    _socketio_opts['client_manager'] = SQLiteBusManager(_bus_url)
+elif _socketio_queue:
+    _socketio_opts['message_queue'] = _socketio_queue
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', logger=False, engineio_logger=False,
+                    **_socketio_opts)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -88,6 +120,16 @@ def _unauthorized():
     # Fallback to default redirect behavior
     return redirect(url_for('login', next=request.url))
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or '').strip() or default)
+    except Exception:
+        return default
+
+# Chat history page size (initial render and each "load older" step)
+CHAT_PAGE_SIZE = max(1, _env_int('CHAT_PAGE_SIZE', 50))
+CHAT_PAGE_MAX = max(CHAT_PAGE_SIZE, _env_int('CHAT_PAGE_MAX', 200))
+
 # AI rate limit (seconds) configurable via env; 0 disables throttling
 def _ai_rate_limit_seconds() -> int:
     try:
@@ -156,6 +198,40 @@ def _log_exc(sender, exception, **extra):  # sender is app
 got_request_exception.connect(_log_exc, app)
 
 
+class _LRUCache:
+    """Small thread-safe in-process LRU map (per worker, best-effort)."""
+
+    def __init__(self, maxsize):
+        self.maxsize = max(1, maxsize)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
 # Simple in-memory rate limiter for sensitive actions (login/register)
 # Note: this is per-process and best-effort; for production use a shared store like Redis.
 _rate_limits = {}
@@ -288,7 +364,7 @@ class User(UserMixin, db.Model):
     experience_level = db.Column(db.String(50), nullable=True)
     looking_for = db.Column(db.String(200), nullable=True)
     avatar_url = db.Column(db.String(200), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     is_online = db.Column(db.Boolean, default=False)
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -298,22 +374,49 @@ class Chat(db.Model):
     user2_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Denormalized inbox summary, maintained by _record_chat_message/_mark_chat_read
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_message_preview = db.Column(db.String(120), nullable=True)
+    last_sender_id = db.Column(db.Integer, nullable=True)
+    unread_user1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    unread_user2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Per-participant read watermark: id of the last message the participant has read
+    last_read_user1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_read_user2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Canonical participant pair (min id, max id): one chat per pair, enforced by a unique index.
+    # NULL only on legacy duplicate rows created before the pair key existed.
+    pair_lo = db.Column(db.Integer, nullable=True)
+    pair_hi = db.Column(db.Integer, nullable=True)
     
     # Relationships to access users participating in the chat
     user1 = db.relationship('User', foreign_keys=[user1_id], backref='chats_as_user1')
     user2 = db.relationship('User', foreign_keys=[user2_id], backref='chats_as_user2')
 
+    __table_args__ = (
+        db.Index('ix_chat_user1_user2', 'user1_id', 'user2_id'),
+        db.Index('ix_chat_user2_user1', 'user2_id', 'user1_id'),
+        db.Index('ux_chat_pair', 'pair_lo', 'pair_hi', unique=True),
+    )
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Legacy per-row flag, no longer written; read state comes from Chat.last_read_user*
     is_read = db.Column(db.Boolean, default=False)
     
     # Relationship to access sender user (used in templates and API responses)
     sender = db.relationship('User', foreign_keys=[sender_id])
 
+    # History pages seek on (chat_id, timestamp, id); delta sync by id cursor on (chat_id, id)
+    __table_args__ = (
+        db.Index('ix_message_chat_ts', 'chat_id', 'timestamp', 'id'),
+        db.Index('ix_message_chat_id', 'chat_id', 'id'),
+    )
+
 # AI assistant utilities
 def get_or_create_ai_user():
     ai = User.query.filter_by(username='DevBot').first()
@@ -326,6 +429,7 @@ def get_or_create_ai_user():
             skills='AI, Python, JavaScript, Freelance, Flask'
         )
         db.session.add(ai)
+        _index_user(ai)
         db.session.commit()
     return ai
 
@@ -347,31 +451,200 @@ def is_allowed_topic(text: str) -> bool:
     return any(k in t for k in programming_kw + freelance_kw + site_kw)
 
 # Site knowledge loader (reads instance/site_knowledge.md, capped length)
-_SITE_KB_CACHE = None
+def _site_knowledge_path():
+    return os.path.join(app.instance_path, 'site_knowledge.md')
 
-def _load_site_knowledge():
-    global _SITE_KB_CACHE
-    if _SITE_KB_CACHE is not None:
-        return _SITE_KB_CACHE
+def _site_knowledge_mtime():
+    try:
+        return os.stat(_site_knowledge_path()).st_mtime_ns
+    except OSError:
+        return None
+
+def _read_site_knowledge():
     try:
-        path = os.path.join(app.instance_path, 'site_knowledge.md')
+        path = _site_knowledge_path()
         if os.path.isfile(path):
             with open(path, 'r', encoding='utf-8') as f:
                 text = f.read()
                 # Cap to ~8KB to avoid bloating context
-                _SITE_KB_CACHE = text[:8192]
-                return _SITE_KB_CACHE
+                return text[:8192]
     except Exception:
         pass
-    _SITE_KB_CACHE = ''
-    return _SITE_KB_CACHE
+    return ''
+
+def _load_site_knowledge():
+    return _prompt_bundle().knowledge
+
+# ===== Pooled keep-alive HTTP client for LLM providers =====
+LLM_POOL_SIZE = max(1, _env_int('LLM_POOL_SIZE', 4))
+LLM_POOL_IDLE_S = max(1, _env_int('LLM_POOL_IDLE_S', 30))
+try:
+    LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+except Exception:
+    LLM_CONNECT_TIMEOUT = 5.0
+try:
+    LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '20'))
+except Exception:
+    LLM_READ_TIMEOUT = 20.0
+
+class _HTTPPool:
+    """Keep-alive connections to one origin, at most `maxsize` of them kept idle for reuse.
+
+    In-flight requests are not capped (like urlopen): when no idle connection is
+    available a new one is opened, and connections released beyond `maxsize`
+    idle ones are closed. Connections are opened with `connect_timeout` and then
+    switched to `read_timeout`, so a dead host fails fast while a slow completion
+    may take its time. Idle connections older than `idle_s` are dropped on
+    checkout; a request that fails on a reused connection before any response
+    (the server closed it while idle) is retried once on a fresh one.
+    """
 
-def _http_post_json(url, headers, payload, timeout=20):
-    data = json.dumps(payload).encode('utf-8')
-    req = urllib.request.Request(url, data=data, headers=headers, method='POST')
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
+    def __init__(self, scheme, host, port, maxsize=LLM_POOL_SIZE, connect_timeout=LLM_CONNECT_TIMEOUT,
+                 read_timeout=LLM_READ_TIMEOUT, idle_s=LLM_POOL_IDLE_S, ssl_context=None):
+        self.scheme, self.host, self.port = scheme, host, port
+        self.connect_timeout, self.read_timeout, self.idle_s = connect_timeout, read_timeout, idle_s
+        self.ssl_context = ssl_context
+        self.maxsize = maxsize
+        self._idle = []  # [(conn, released_at)], most recent last
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.requests = 0
+
+    def _connect(self):
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout,
+                                               context=self.ssl_context or ssl.create_default_context())
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.opened += 1
+        return conn
+
+    def _checkout(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, released = self._idle.pop()
+                if now - released < self.idle_s:
+                    return conn, True
+                conn.close()
+        return self._connect(), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def open(self, method, path, body, headers):
+        """Send a request; returns (conn, response). Pass both to release() once the body is read."""
+        self.requests += 1
+        for attempt in (0, 1):
+            try:
+                # The retry never takes another idle connection: it may be just as stale
+                conn, reused = self._checkout() if not attempt else (self._connect(), False)
+            except (OSError, http.client.HTTPException) as e:
+                raise urllib.error.URLError(e)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                conn.close()
+                if not reused:
+                    raise urllib.error.URLError(e)
+            except (OSError, http.client.HTTPException) as e:
+                # e.g. BadStatusLine: surface it like any network error so retries apply
+                conn.close()
+                raise urllib.error.URLError(e)
+
+    def release(self, conn, resp, reuse=True):
+        if reuse and resp.isclosed() and not resp.will_close:
+            self._checkin(conn)
+        else:
+            conn.close()
+
+    def stats(self):
+        return {'opened': self.opened, 'requests': self.requests, 'idle': len(self._idle)}
+
+_http_pools = {}
+_http_pools_lock = threading.Lock()
+
+def _http_pool(url):
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    key = (parts.scheme, parts.hostname, port)
+    with _http_pools_lock:
+        pool = _http_pools.get(key)
+        if pool is None:
+            pool = _http_pools[key] = _HTTPPool(parts.scheme, parts.hostname, port)
+        return pool
+
+def _http_post_json(url, headers, payload, pool=None):
+    """POST JSON over a pooled keep-alive connection. Raises urllib.error.HTTPError for
+    4xx/5xx and URLError for network failures, like urlopen did, so callers keep their retry logic."""
+    pool = pool or _http_pool(url)
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    conn, resp = pool.open('POST', path, json.dumps(payload).encode('utf-8'), headers)
+    read_ok = False
+    try:
         body = resp.read()
-        return json.loads(body.decode('utf-8', errors='ignore'))
+        read_ok = True
+    except (OSError, http.client.HTTPException) as e:
+        resp.close()
+        raise urllib.error.URLError(e)
+    finally:
+        # A half-read response leaves bytes on the socket: never reuse that connection
+        pool.release(conn, resp, reuse=read_ok)
+    if resp.status >= 400:
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+    return json.loads(body.decode('utf-8', errors='ignore'))
+
+def _http_post_sse(url, headers, payload, pool=None):
+    """POST a streaming chat completion and yield the `delta.content` pieces of its
+    server-sent events until `data: [DONE]`. The connection goes back to the pool
+    only if the stream was read to the end."""
+    pool = pool or _http_pool(url)
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    conn, resp = pool.open('POST', path, json.dumps(payload).encode('utf-8'),
+                           dict(headers, Accept='text/event-stream'))
+    done = False
+    try:
+        if resp.status >= 400:
+            body = resp.read()
+            done = True
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+        while True:
+            try:
+                line = resp.readline()
+            except (OSError, http.client.HTTPException) as e:
+                raise urllib.error.URLError(e)
+            if not line:
+                done = True
+                break
+            line = line.strip()
+            if not line.startswith(b'data:'):
+                continue
+            data = line[5:].strip()
+            if data == b'[DONE]':
+                resp.read()
+                done = True
+                break
+            try:
+                event = json.loads(data.decode('utf-8', errors='ignore'))
+            except ValueError:
+                continue
+            delta = ((event.get('choices') or [{}])[0].get('delta') or {}).get('content')
+            if delta:
+                yield delta
+    finally:
+        if not done:
+            resp.close()
+        pool.release(conn, resp, reuse=done)
 
 def _get_ai_cfg():
     provider = (os.getenv('AI_PROVIDER') or '').strip().lower()
@@ -553,7 +826,310 @@ def _route_summary():
     except Exception:
         return ''
 
-def _llm_chat(messages):
+def _estimate_tokens(text):
+    """Rough token count: ~4 UTF-8 bytes per token (about 2 Cyrillic or 4 Latin chars);
+    errs on the high side for Russian, which is what budgets want."""
+    return (len((text or '').encode('utf-8')) + 3) // 4
+
+def _estimate_message_tokens(messages):
+    # +4 per message for role/separators in chat formats
+    return sum(_estimate_tokens(m.get('content')) + 4 for m in messages)
+
+# System context shared by /api/ai_reply and /api/ai_suggest: system prompt, site
+# knowledge, route map and few-shots, assembled once and reused until
+# instance/site_knowledge.md changes (mtime). `messages` is a tuple of dicts that
+# must not be mutated; requests build their payload as list(messages) + history.
+# `sections` splits it into 'core' (prompt + knowledge), 'routes' and 'shots' as
+# name -> (messages, tokens), so the history budget can leave out the optional ones.
+_PromptBundle = namedtuple('_PromptBundle', 'messages version tokens knowledge kb_mtime sections')
+_prompt_bundle_cache = None
+_prompt_bundle_lock = threading.Lock()
+
+def _build_prompt_bundle(kb_mtime):
+    kb = _read_site_knowledge()
+    core = [{'role': 'system', 'content': _build_system_prompt()}]
+    if kb:
+        core.append({'role': 'system', 'content': 'Справка о сайте DevConnect:\n' + kb})
+    routes = _route_summary()
+    route_msgs = [{'role': 'system', 'content': 'Карта маршрутов (сокращённо):\n' + routes}] if routes else []
+    sections = {
+        name: (tuple(msgs), _estimate_message_tokens(msgs))
+        for name, msgs in (('core', core), ('routes', route_msgs), ('shots', _few_shots()))
+    }
+    messages = sections['core'][0] + sections['routes'][0] + sections['shots'][0]
+    raw = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    version = hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+    return _PromptBundle(messages, version, _estimate_message_tokens(messages), kb, kb_mtime, sections)
+
+def _prompt_bundle():
+    """Current system-context bundle; rebuilt only when site_knowledge.md's mtime changes."""
+    global _prompt_bundle_cache
+    kb_mtime = _site_knowledge_mtime()
+    bundle = _prompt_bundle_cache
+    if bundle is not None and bundle.kb_mtime == kb_mtime:
+        return bundle
+    with _prompt_bundle_lock:
+        bundle = _prompt_bundle_cache
+        if bundle is None or bundle.kb_mtime != kb_mtime:
+            bundle = _prompt_bundle_cache = _build_prompt_bundle(kb_mtime)
+            app.logger.info('AI prompt bundle %s built (~%d tokens)', bundle.version, bundle.tokens)
+    return bundle
+
+# ===== Token-budgeted AI history =====
+# The payload (system context + rolling summary + history) must fit AI_PROMPT_BUDGET
+# tokens. When it doesn't, the oldest turns are folded into the summary down to
+# AI_HISTORY_FOLD_TARGET of the budget, so folding (an extra LLM call) happens
+# once per several turns rather than on every request. The summary lives in the
+# session next to ai_history.
+AI_PROMPT_BUDGET = max(1000, _env_int('AI_PROMPT_BUDGET', 6000))
+AI_CONTEXT_WINDOW = max(2000, _env_int('AI_CONTEXT_WINDOW', 16000))
+AI_MIN_REPLY_TOKENS = max(64, _env_int('AI_MIN_REPLY_TOKENS', 300))
+AI_SUMMARY_TOKENS = max(64, _env_int('AI_SUMMARY_TOKENS', 300))
+AI_HISTORY_KEEP = max(1, _env_int('AI_HISTORY_KEEP', 4))  # newest messages never folded
+try:
+    AI_HISTORY_FOLD_TARGET = float(os.getenv('AI_HISTORY_FOLD_TARGET', '0.6'))
+except Exception:
+    AI_HISTORY_FOLD_TARGET = 0.6
+
+def _ai_summary_get():
+    try:
+        return session.get('ai_summary', '')
+    except Exception:
+        return ''
+
+def _ai_summary_set(text):
+    try:
+        session['ai_summary'] = text
+    except Exception:
+        pass
+
+def _adaptive_max_tokens(messages, cap):
+    """Reply budget: what is left of AI_CONTEXT_WINDOW after the prompt, within [AI_MIN_REPLY_TOKENS, cap]."""
+    room = AI_CONTEXT_WINDOW - _estimate_message_tokens(messages) - 64
+    return max(min(AI_MIN_REPLY_TOKENS, cap), min(cap, room))
+
+def _clip_text(text, max_tokens):
+    """Keep the head and tail of an oversized message (e.g. a long code paste)."""
+    tokens = _estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = max(0, int(len(text) * max_tokens / tokens) - 32)
+    head = keep * 2 // 3
+    return text[:head] + '\n…[фрагмент сокращён]…\n' + text[len(text) - (keep - head):]
+
+def _summarize_turns(summary, turns):
+    """Fold `turns` into the running `summary` (LLM when configured, extractive otherwise)."""
+    lines = [f"{'Пользователь' if t.get('role') == 'user' else 'DevBot'}: {_clip_text(t.get('content') or '', 400)}" for t in turns]
+    transcript = '\n'.join(lines)
+    prompt = [
+        {'role': 'system', 'content': (
+            'Сожми диалог пользователя с DevBot в краткое резюме до 6 пунктов: цель пользователя, стек, '
+            'что уже обсудили и решили, открытые вопросы. Только факты из диалога, без вступлений. Отвечай на русском.'
+        )},
+        {'role': 'user', 'content': ('Прежнее резюме:\n' + summary + '\n\n' if summary else '') + 'Новые реплики:\n' + transcript},
+    ]
+    text = _llm_chat(prompt, max_tokens=AI_SUMMARY_TOKENS)
+    if text:
+        return _clip_text(text.strip(), AI_SUMMARY_TOKENS)
+    # Fallback: first line of each turn, newest kept when over the budget
+    brief = [' '.join(line.split())[:200] for line in lines]
+    text = '\n'.join(([summary] if summary else []) + brief)
+    if len(text) > AI_SUMMARY_TOKENS * 2:
+        text = text[-AI_SUMMARY_TOKENS * 2:].partition('\n')[2]  # whole lines only
+    return text
+
+def _ai_context(history, extra=()):
+    """Fit system context + summary + history (+ `extra`, e.g. the suggest guide) into AI_PROMPT_BUDGET.
+
+    Folds the oldest turns into the session summary when over budget and stores the
+    shortened history. The route map is sent only when recent user turns touch site
+    sections, few-shots only while they fit. Returns (messages, history).
+    """
+    bundle = _prompt_bundle()
+    sections = bundle.sections
+    summary = _ai_summary_get()
+    extra = list(extra)
+    fixed = sections['core'][1] + _estimate_message_tokens(extra)
+    recent_user = ' '.join(h.get('content') or '' for h in history[-AI_HISTORY_KEEP:] if h.get('role') == 'user')
+    want_routes = bool(sections['routes'][0]) and bool(_site_suggestions(recent_user))
+    if want_routes:
+        fixed += sections['routes'][1]
+
+    def summary_message(text):
+        return [{'role': 'system', 'content': 'Краткое содержание предыдущего диалога:\n' + text}] if text else []
+
+    def summary_tokens(text):
+        return _estimate_message_tokens(summary_message(text))
+
+    hist_tokens = _estimate_message_tokens(history)
+    if fixed + summary_tokens(summary) + hist_tokens > AI_PROMPT_BUDGET and len(history) > AI_HISTORY_KEEP:
+        target = AI_PROMPT_BUDGET * AI_HISTORY_FOLD_TARGET - fixed - AI_SUMMARY_TOKENS
+        cut = 0
+        while len(history) - cut > AI_HISTORY_KEEP and hist_tokens > target:
+            hist_tokens -= _estimate_message_tokens(history[cut:cut + 1])
+            cut += 1
+        summary = _summarize_turns(summary, history[:cut])
+        history = history[cut:]
+        _ai_summary_set(summary)
+        _ai_history_set(history)
+
+    payload_history = history
+    over = fixed + summary_tokens(summary) + hist_tokens - AI_PROMPT_BUDGET
+    if over > 0:
+        # Still too big with only the newest turns left: clip the largest ones (payload only)
+        payload_history = [dict(h) for h in history]
+        for h in sorted(payload_history, key=lambda m: -_estimate_tokens(m.get('content'))):
+            if over <= 0:
+                break
+            tokens = _estimate_tokens(h.get('content'))
+            h['content'] = _clip_text(h.get('content') or '', max(64, tokens - over))
+            over -= tokens - _estimate_tokens(h['content'])
+        hist_tokens = _estimate_message_tokens(payload_history)
+
+    messages = list(sections['core'][0])
+    if want_routes:
+        messages += sections['routes'][0]
+    if fixed + sections['shots'][1] + summary_tokens(summary) + hist_tokens <= AI_PROMPT_BUDGET:
+        messages += sections['shots'][0]
+    return messages + summary_message(summary) + payload_history + extra, history
+
+class _LLMResponseCache:
+    """LRU+TTL cache of completions keyed on a hash of the normalized request.
+
+    The key covers provider/model, sampling settings and every message (system
+    prompt, few-shots, history, user text). Only surrounding whitespace is
+    stripped: case, indentation and punctuation can change the meaning of code
+    and identifiers, so the content is otherwise kept verbatim. Sampling hotter
+    than `max_temperature` is meant to vary, so it is never served from cache;
+    answers longer than `max_chars` are not stored.
+    """
+
+    def __init__(self, maxsize, ttl_s, max_chars, max_temperature):
+        self.ttl_s = ttl_s
+        self.max_chars = max_chars
+        self.max_temperature = max_temperature
+        self._entries = _LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.too_large = 0
+
+    @staticmethod
+    def _normalize(text):
+        return str(text or '').strip()
+
+    def key(self, cfg, messages, tun, **extra):
+        if tun.get('temperature', 0) > self.max_temperature or self.ttl_s <= 0:
+            return None
+        request_part = {
+            'provider': cfg.get('provider'),
+            'model': cfg.get('model') or cfg.get('deployment'),
+            'tun': tun,
+            'extra': extra,
+            'messages': [(m.get('role'), self._normalize(m.get('content'))) for m in messages],
+        }
+        raw = json.dumps(request_part, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if key is None:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl_s:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+        if entry is not None:
+            self._entries.pop(key)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, text):
+        """Store `text` under `key` (if cacheable) and return it unchanged."""
+        if key is None or not text:
+            return text
+        if len(text) > self.max_chars:
+            with self._lock:
+                self.too_large += 1
+            return text
+        self._entries.set(key, (time.monotonic(), text))
+        return text
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+                'bypassed': self.bypassed,
+                'too_large': self.too_large,
+                'entries': len(self._entries),
+            }
+
+try:
+    LLM_CACHE_MAX_TEMPERATURE = float(os.getenv('LLM_CACHE_MAX_TEMPERATURE', '0.9'))
+except Exception:
+    LLM_CACHE_MAX_TEMPERATURE = 0.9
+
+_llm_cache = _LLMResponseCache(
+    max(1, _env_int('LLM_CACHE_SIZE', 512)),
+    _env_int('LLM_CACHE_TTL', 3600),
+    max(1, _env_int('LLM_CACHE_MAX_CHARS', 8000)),
+    LLM_CACHE_MAX_TEMPERATURE,
+)
+
+def _llm_cache_opt_out(data):
+    """Client asked for a fresh answer: {"no_cache": true} or Cache-Control: no-cache."""
+    return bool(data.get('no_cache')) or 'no-cache' in (request.headers.get('Cache-Control') or '')
+
+def _llm_tunables():
+    """Sampling settings from the environment (AI_TEMPERATURE, AI_MAX_TOKENS, penalties)."""
+    try:
+        temperature = float(os.getenv('AI_TEMPERATURE', '0.7'))
+    except Exception:
+        temperature = 0.7
+    try:
+        max_tokens = int(os.getenv('AI_MAX_TOKENS', '800'))
+    except Exception:
+        max_tokens = 800
+    try:
+        presence_penalty = float(os.getenv('AI_PRESENCE_PENALTY', '0.6'))
+    except Exception:
+        presence_penalty = 0.6
+    try:
+        frequency_penalty = float(os.getenv('AI_FREQUENCY_PENALTY', '0.7'))
+    except Exception:
+        frequency_penalty = 0.7
+    return {'temperature': temperature, 'max_tokens': max_tokens,
+            'presence_penalty': presence_penalty, 'frequency_penalty': frequency_penalty}
+
+def _llm_request(cfg, messages, tun, max_tokens, stream=False):
+    """(url, headers, payload) of a chat completion for the configured provider."""
+    if cfg['provider'] == 'azure':
+        api_version = '2024-02-15-preview'
+        url = f"{cfg['endpoint']}/openai/deployments/{cfg['deployment']}/chat/completions?api-version={api_version}"
+        headers = {
+            'api-key': cfg['key'],
+            'Content-Type': 'application/json'
+        }
+        payload = { 'messages': messages, 'temperature': tun['temperature'], 'max_tokens': max_tokens, 'presence_penalty': tun['presence_penalty'], 'frequency_penalty': tun['frequency_penalty'] }
+    else:
+        url = 'https://api.deepseek.com/chat/completions' if cfg['provider'] == 'deepseek' else 'https://api.openai.com/v1/chat/completions'
+        headers = {
+            'Authorization': f"Bearer {cfg['key']}",
+            'Content-Type': 'application/json'
+        }
+        payload = { 'model': cfg['model'], 'messages': messages, 'temperature': tun['temperature'], 'max_tokens': max_tokens }
+    if stream:
+        payload['stream'] = True
+    return url, headers, payload
+
+def _llm_chat(messages, cache=True, max_tokens=None):
     cfg = _get_ai_cfg()
     if not cfg:
         try:
@@ -561,31 +1137,20 @@ def _llm_chat(messages):
         except Exception:
             pass
         return None
+    # Tunables from environment; the reply budget adapts to the prompt size
+    tun = _llm_tunables()
+    tun['max_tokens'] = _adaptive_max_tokens(messages, max_tokens or tun['max_tokens'])
+    key = _llm_cache.key(cfg, messages, tun) if cache else None
+    cached = _llm_cache.get(key)
+    if cached is not None:
+        return cached
+    return _llm_cache.put(key, _llm_complete(cfg, messages, tun))
+
+def _llm_complete(cfg, messages, tun):
     try:
-        # Tunables from environment
-        try:
-            temperature = float(os.getenv('AI_TEMPERATURE', '0.7'))
-        except Exception:
-            temperature = 0.7
-        try:
-            max_tokens = int(os.getenv('AI_MAX_TOKENS', '800'))
-        except Exception:
-            max_tokens = 800
-        try:
-            presence_penalty = float(os.getenv('AI_PRESENCE_PENALTY', '0.6'))
-        except Exception:
-            presence_penalty = 0.6
-        try:
-            frequency_penalty = float(os.getenv('AI_FREQUENCY_PENALTY', '0.7'))
-        except Exception:
-            frequency_penalty = 0.7
+        max_tokens = tun['max_tokens']
         if cfg['provider'] == 'deepseek':
-            url = 'https://api.deepseek.com/chat/completions'
-            headers = {
-                'Authorization': f"Bearer {cfg['key']}",
-                'Content-Type': 'application/json'
-            }
-            # Retry/backoff for rate limits and transient errors, with token reduction per attempt
+            # Retry/backoff for rate limits and transient errors
             try:
                 attempts = int(os.getenv('AI_RETRY_ATTEMPTS', '2'))
             except Exception:
@@ -594,16 +1159,10 @@ def _llm_chat(messages):
                 backoff = float(os.getenv('AI_RETRY_BACKOFF', '1.5'))
             except Exception:
                 backoff = 1.5
-            base_max_tokens = max_tokens
+            # max_tokens is already sized to the prompt (_adaptive_max_tokens) and the
+            # prompt to AI_PROMPT_BUDGET, so retries resend the same request
+            url, headers, payload = _llm_request(cfg, messages, tun, max_tokens)
             for attempt in range(attempts + 1):
-                # reduce tokens progressively to ease provider pressure
-                adj_max_tokens = max(300, int(base_max_tokens * (0.7 ** attempt)))
-                payload = {
-                    'model': cfg['model'],
-                    'messages': messages,
-                    'temperature': temperature,
-                    'max_tokens': adj_max_tokens
-                }
                 try:
                     data = _http_post_json(url, headers, payload)
                     c = (data.get('choices') or [{}])[0].get('message', {}).get('content')
@@ -621,7 +1180,7 @@ def _llm_chat(messages):
                         except Exception:
                             wait_s = max(0.5, backoff ** attempt)
                         try:
-                            app.logger.info(f"DeepSeek retry {attempt+1}/{attempts} after {wait_s:.1f}s due to HTTP {getattr(he, 'code', 'unknown')}, max_tokens={adj_max_tokens}")
+                            app.logger.info(f"DeepSeek retry {attempt+1}/{attempts} after {wait_s:.1f}s due to HTTP {getattr(he, 'code', 'unknown')}, max_tokens={max_tokens}")
                         except Exception:
                             pass
                         time.sleep(wait_s)
@@ -633,24 +1192,8 @@ def _llm_chat(messages):
                         time.sleep(wait_s)
                         continue
                     raise
-        if cfg['provider'] == 'openai':
-            url = 'https://api.openai.com/v1/chat/completions'
-            headers = {
-                'Authorization': f"Bearer {cfg['key']}",
-                'Content-Type': 'application/json'
-            }
-            payload = { 'model': cfg['model'], 'messages': messages, 'temperature': temperature, 'max_tokens': max_tokens }
-            data = _http_post_json(url, headers, payload)
-            c = (data.get('choices') or [{}])[0].get('message', {}).get('content')
-            return c or None
-        if cfg['provider'] == 'azure':
-            api_version = '2024-02-15-preview'
-            url = f"{cfg['endpoint']}/openai/deployments/{cfg['deployment']}/chat/completions?api-version={api_version}"
-            headers = {
-                'api-key': cfg['key'],
-                'Content-Type': 'application/json'
-            }
-            payload = { 'messages': messages, 'temperature': temperature, 'max_tokens': max_tokens, 'presence_penalty': presence_penalty, 'frequency_penalty': frequency_penalty }
+        if cfg['provider'] in ('openai', 'azure'):
+            url, headers, payload = _llm_request(cfg, messages, tun, max_tokens)
             data = _http_post_json(url, headers, payload)
             c = (data.get('choices') or [{}])[0].get('message', {}).get('content')
             return c or None
@@ -667,6 +1210,38 @@ def _llm_chat(messages):
         return None
     return None
 
+def _llm_chat_stream(messages, cache=True):
+    """Yield completion text deltas as the provider streams them (`stream: true` SSE).
+    Yields nothing if AI is not configured; on provider errors logs, stores
+    g.llm_error_code and stops, so callers fall back like with _llm_chat.
+    A cached answer comes as a single delta; a fully received one is cached.
+    """
+    cfg = _get_ai_cfg()
+    if not cfg:
+        return
+    tun = _llm_tunables()
+    tun['max_tokens'] = _adaptive_max_tokens(messages, tun['max_tokens'])
+    key = _llm_cache.key(cfg, messages, tun) if cache else None
+    cached = _llm_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    url, headers, payload = _llm_request(cfg, messages, tun, tun['max_tokens'], stream=True)
+    parts = []
+    try:
+        for delta in _http_post_sse(url, headers, payload):
+            parts.append(delta)
+            yield delta
+        _llm_cache.put(key, ''.join(parts) or None)
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        try:
+            g.llm_error_code = getattr(e, 'code', None)
+        except Exception:
+            pass
+        app.logger.error('LLM stream error:\n%s', traceback.format_exc())
+
 def _llm_reply(user_text):
     cfg = _get_ai_cfg()
     if not cfg:
@@ -679,19 +1254,16 @@ def _llm_reply(user_text):
         { 'role': 'system', 'content': sys_prompt },
         { 'role': 'user', 'content': user_text }
     ]
+    # Ключ кэша и запрос строятся из одних и тех же настроек
+    tun = _llm_tunables()
+    key = _llm_cache.key(cfg, messages, tun, kind='devbot')
+    cached = _llm_cache.get(key)
+    if cached is not None:
+        return cached
+    temperature = tun['temperature']
+    presence_penalty = tun['presence_penalty']
+    frequency_penalty = tun['frequency_penalty']
     try:
-        try:
-            temperature = float(os.getenv('AI_TEMPERATURE', '0.7'))
-        except Exception:
-            temperature = 0.7
-        try:
-            presence_penalty = float(os.getenv('AI_PRESENCE_PENALTY', '0.6'))
-        except Exception:
-            presence_penalty = 0.6
-        try:
-            frequency_penalty = float(os.getenv('AI_FREQUENCY_PENALTY', '0.7'))
-        except Exception:
-            frequency_penalty = 0.7
         if cfg['provider'] == 'deepseek':
             url = 'https://api.deepseek.com/chat/completions'
             headers = {
@@ -708,7 +1280,7 @@ def _llm_reply(user_text):
             }
             data = _http_post_json(url, headers, payload)
             c = (data.get('choices') or [{}])[0].get('message', {}).get('content')
-            return c or None
+            return _llm_cache.put(key, c) or None
         if cfg['provider'] == 'openai':
             url = 'https://api.openai.com/v1/chat/completions'
             headers = {
@@ -718,7 +1290,7 @@ def _llm_reply(user_text):
             payload = { 'model': cfg['model'], 'messages': messages, 'temperature': temperature, 'presence_penalty': presence_penalty, 'frequency_penalty': frequency_penalty }
             data = _http_post_json(url, headers, payload)
             c = (data.get('choices') or [{}])[0].get('message', {}).get('content')
-            return c or None
+            return _llm_cache.put(key, c) or None
         if cfg['provider'] == 'azure':
             api_version = '2024-02-15-preview'
             url = f"{cfg['endpoint']}/openai/deployments/{cfg['deployment']}/chat/completions?api-version={api_version}"
@@ -729,11 +1301,50 @@ def _llm_reply(user_text):
             payload = { 'messages': messages, 'temperature': temperature, 'presence_penalty': presence_penalty, 'frequency_penalty': frequency_penalty }
             data = _http_post_json(url, headers, payload)
             c = (data.get('choices') or [{}])[0].get('message', {}).get('content')
-            return c or None
+            return _llm_cache.put(key, c) or None
     except Exception:
         return None
     return None
 
+# Bounded background pool for DevBot replies in regular chats, so /send_message
+# returns without waiting for the LLM provider round trip
+AI_REPLY_WORKERS = max(1, _env_int('AI_REPLY_WORKERS', 4))
+AI_REPLY_QUEUE = max(AI_REPLY_WORKERS, _env_int('AI_REPLY_QUEUE', 32))
+_ai_reply_pool = ThreadPoolExecutor(max_workers=AI_REPLY_WORKERS, thread_name_prefix='devbot')
+_ai_reply_slots = threading.BoundedSemaphore(AI_REPLY_QUEUE)
+
+def _deliver_ai_reply(chat_id, ai_id, text):
+    try:
+        with app.app_context():
+            content = generate_ai_reply(text)
+            chat = Chat.query.get(chat_id)
+            if not chat:
+                return
+            reply = Message(chat_id=chat_id, sender_id=ai_id, content=content)
+            db.session.add(reply)
+            _record_chat_message(chat, reply)
+            db.session.commit()
+            payload = _message_payload(reply, chat)
+        socketio.emit('message:new', payload, room=f"chat_{chat_id}")
+    except Exception:
+        try:
+            app.logger.error('DevBot background reply failed:\n%s', traceback.format_exc())
+        except Exception:
+            pass
+    finally:
+        _ai_reply_slots.release()
+
+def _queue_ai_reply(chat_id, ai_id, text):
+    """Schedule a DevBot reply. Returns False when the queue is full."""
+    if not _ai_reply_slots.acquire(blocking=False):
+        return False
+    try:
+        _ai_reply_pool.submit(_deliver_ai_reply, chat_id, ai_id, text)
+    except RuntimeError:
+        _ai_reply_slots.release()
+        return False
+    return True
+
 def generate_ai_reply(text):
     t = (text or '').lower()
     # Handle small talk first for direct DevBot chats
@@ -786,10 +1397,706 @@ class FreelanceJob(db.Model):
     is_remote = db.Column(db.Boolean, default=True)
     location = db.Column(db.String(120), nullable=True)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # When job_match was last computed for this job; NULL = stale, recomputed on next view
+    matched_at = db.Column(db.DateTime, nullable=True)
     
     author = db.relationship('User', foreign_keys=[author_id])
 
+# Normalized skills: User.skills / FreelanceJob.skills stay the source of truth for display,
+# the link tables mirror them for indexed filters and GROUP BY facets (see _sync_skills)
+class Skill(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(60), unique=True, nullable=False)  # lowercased, single spaces
+    name = db.Column(db.String(60), nullable=False)  # first spelling seen, for display
+
+class UserSkill(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill.id'), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_user_skill_skill', 'skill_id', 'user_id'),
+    )
+
+class JobSkill(db.Model):
+    job_id = db.Column(db.Integer, db.ForeignKey('freelance_job.id'), primary_key=True)
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill.id'), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_job_skill_skill', 'skill_id', 'job_id'),
+    )
+
+# Precomputed top-K candidates per job (see _compute_job_matches)
+class JobMatch(db.Model):
+    job_id = db.Column(db.Integer, db.ForeignKey('freelance_job.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    user = db.relationship('User', foreign_keys=[user_id])
+
+    __table_args__ = (
+        db.Index('ix_job_match_user', 'user_id', 'job_id'),
+    )
+
+# Per-user "jobs matching my skills" feed, written on job creation (see _fan_out_job)
+class JobFeedItem(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('freelance_job.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)  # copy of the job's created_at, the feed order
+    matched = db.Column(db.Integer, nullable=False, default=1)  # number of shared skills
+
+    __table_args__ = (
+        db.Index('ix_job_feed_user_created', 'user_id', 'created_at', 'job_id'),
+        db.Index('ix_job_feed_job', 'job_id'),
+    )
+
+# ===== Full-text search (SQLite FTS5) =====
+# user_fts / job_fts mirror the searchable columns keyed by the source row id (rowid);
+# kept in sync by _fts_index_user / _fts_index_job inside the writing transaction
+_FTS_ENABLED = {}
+USER_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5("
+    "username, bio, skills, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+JOB_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS job_fts USING fts5("
+    "title, description, skills, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+_FTS_SOURCES = {
+    'user_fts': (USER_FTS_DDL, 'user',
+                 "INSERT INTO user_fts (rowid, username, bio, skills) "
+                 "SELECT id, username, COALESCE(bio, ''), COALESCE(skills, '') FROM user"),
+    'job_fts': (JOB_FTS_DDL, 'freelance_job',
+                "INSERT INTO job_fts (rowid, title, description, skills) "
+                "SELECT id, title, description, COALESCE(skills, '') FROM freelance_job"),
+}
+# bm25 costs per scored row and a 2-3 letter prefix hits tens of thousands of users, so only
+# the USER_FTS_CANDIDATES newest hits are scored (FTS5 walks rowids backwards and stops).
+# Older users whose name starts with the query come from _username_index (:names) and sort
+# ahead of every bm25 score (which is always negative), alphabetically
+USER_FTS_CANDIDATES = max(10, _env_int('USER_FTS_CANDIDATES', 1000))
+USER_FTS_NAME_HITS = max(0, _env_int('USER_FTS_NAME_HITS', 50))
+USER_FTS_RANK_SQL = (
+    'SELECT user_id, MIN(score) AS score FROM ('
+    'SELECT value AS user_id, key - 1e9 AS score FROM json_each(:names) UNION ALL '
+    'SELECT * FROM (SELECT rowid AS user_id, bm25(user_fts, 10.0, 1.0, 4.0) AS score FROM user_fts '
+    'WHERE user_fts MATCH :m ORDER BY rowid DESC LIMIT :k)'
+    ') GROUP BY user_id'
+)
+JOB_FTS_CANDIDATES = max(10, _env_int('JOB_FTS_CANDIDATES', 1000))
+JOB_FTS_RANK_SQL = (
+    'SELECT rowid AS job_id, bm25(job_fts, 8.0, 1.0, 4.0) AS score FROM job_fts WHERE job_fts MATCH :m '
+    'ORDER BY score LIMIT :k'
+)
+# Highlight markers from the private use area: survive HTML escaping, then become <mark>
+_HL_OPEN, _HL_CLOSE = '\ue000', '\ue001'
+
+def _fts_enabled(table='user_fts'):
+    """True when the FTS5 table exists (created by _ensure_fts); checked once per process."""
+    if table not in _FTS_ENABLED:
+        try:
+            _FTS_ENABLED[table] = db.session.execute(db.text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': table}).first() is not None
+        except Exception:
+            _FTS_ENABLED[table] = False
+    return _FTS_ENABLED[table]
+
+def _ensure_fts():
+    """Create the FTS5 indexes if SQLite supports them and rebuild any out of sync with its source."""
+    for table, (ddl, source, fill_sql) in _FTS_SOURCES.items():
+        try:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(ddl)
+                n_fts = conn.exec_driver_sql(f'SELECT COUNT(*) FROM {table}').scalar()
+                n_src = conn.exec_driver_sql(f'SELECT COUNT(*) FROM {source}').scalar()
+                if n_fts != n_src:
+                    conn.exec_driver_sql(f'DELETE FROM {table}')
+                    conn.exec_driver_sql(fill_sql)
+            _FTS_ENABLED[table] = True
+        except Exception as e:
+            app.logger.warning('FTS5 table %s unavailable, search falls back to LIKE: %s', table, e)
+            _FTS_ENABLED[table] = False
+
+def _fts_index_user(user):
+    """Upsert a user into user_fts within the current transaction (caller commits)."""
+    if not _fts_enabled('user_fts'):
+        return
+    db.session.flush()
+    db.session.execute(db.text('DELETE FROM user_fts WHERE rowid = :id'), {'id': user.id})
+    db.session.execute(db.text(
+        'INSERT INTO user_fts (rowid, username, bio, skills) VALUES (:id, :username, :bio, :skills)'
+    ), {'id': user.id, 'username': user.username, 'bio': user.bio or '', 'skills': user.skills or ''})
+
+def _fts_index_job(job):
+    """Upsert a job into job_fts within the current transaction (caller commits)."""
+    if not _fts_enabled('job_fts'):
+        return
+    db.session.flush()
+    db.session.execute(db.text('DELETE FROM job_fts WHERE rowid = :id'), {'id': job.id})
+    db.session.execute(db.text(
+        'INSERT INTO job_fts (rowid, title, description, skills) VALUES (:id, :title, :description, :skills)'
+    ), {'id': job.id, 'title': job.title, 'description': job.description, 'skills': job.skills or ''})
+
+def _fts_match_expr(text, column=None):
+    """FTS5 MATCH expression: every word of `text` as a quoted prefix term, ANDed."""
+    tokens = re.findall(r'\w+', (text or '').lower())[:8]
+    if not tokens:
+        return None
+    terms = ' AND '.join(f'"{t}"*' for t in tokens)
+    return f'{{{column}}} : ({terms})' if column else f'({terms})'
+
+def _user_fts_ranked(q='', skill=''):
+    """Subquery (user_id, score) of FTS matches, lower score = better (bm25).
+    Username weighs most, then skills, then bio. None if there is nothing to match or no FTS.
+    Name-prefix hits are only added without a skill filter, which they may not satisfy.
+    """
+    parts = [p for p in (_fts_match_expr(q), _fts_match_expr(skill, 'skills')) if p]
+    if not parts or not _fts_enabled('user_fts'):
+        return None
+    names = _username_index.prefix(q, USER_FTS_NAME_HITS) if q and not skill else []
+    return db.text(USER_FTS_RANK_SQL).bindparams(
+        m=' AND '.join(parts), k=USER_FTS_CANDIDATES, names=json.dumps(names)
+    ).columns(user_id=db.Integer, score=db.Float).subquery('user_fts_hits')
+
+def _job_fts_match(q='', skill=''):
+    parts = [p for p in (_fts_match_expr(q), _fts_match_expr(skill, 'skills')) if p]
+    return ' AND '.join(parts) if parts else None
+
+def _job_fts_ranked(match):
+    """Subquery (job_id, score) of the JOB_FTS_CANDIDATES best-scoring job matches (all hits
+    are ranked, not just the oldest); title weighs most."""
+    return db.text(JOB_FTS_RANK_SQL).bindparams(m=match, k=JOB_FTS_CANDIDATES).columns(job_id=db.Integer, score=db.Float).subquery('job_fts_hits')
+
+def _job_fts_highlights(match, job_ids):
+    """{job_id: (title_html, snippet_html)} with matched terms wrapped in <mark>; text is HTML-escaped."""
+    if not job_ids:
+        return {}
+    rows = db.session.execute(db.text(
+        'SELECT rowid, highlight(job_fts, 0, :o, :c), snippet(job_fts, 1, :o, :c, \'…\', 24) '
+        'FROM job_fts WHERE job_fts MATCH :m AND rowid IN (SELECT value FROM json_each(:ids))'
+    ), {'o': _HL_OPEN, 'c': _HL_CLOSE, 'm': match, 'ids': json.dumps(list(job_ids))}).all()
+
+    def mark(text):
+        html = str(escape(text or ''))
+        return Markup(html.replace(_HL_OPEN, '<mark>').replace(_HL_CLOSE, '</mark>'))
+
+    return {rid: (mark(title), mark(snip)) for rid, title, snip in rows}
+
+# ===== Normalized skills =====
+def _skill_slug(name):
+    return ' '.join((name or '').lower().split())[:60]
+
+def _parse_skills(text):
+    """Comma-separated skills -> [(slug, name)], deduplicated by slug, original order kept."""
+    seen = {}
+    for part in (text or '').split(','):
+        name = ' '.join(part.split())[:60]
+        slug = _skill_slug(name)
+        if slug and slug not in seen:
+            seen[slug] = name
+    return list(seen.items())
+
+def _skill_ids(parsed):
+    """Skill ids for [(slug, name)], creating missing Skill rows in the current transaction."""
+    if not parsed:
+        return []
+    slugs = [slug for slug, _ in parsed]
+    known = dict(db.session.query(Skill.slug, Skill.id).filter(Skill.slug.in_(slugs)).all())
+    missing = [{'slug': slug, 'name': name} for slug, name in parsed if slug not in known]
+    if missing:
+        # A concurrent register/edit_profile may add the same new skill: keep whichever row wins
+        db.session.execute(db.text('INSERT OR IGNORE INTO skill (slug, name) VALUES (:slug, :name)'), missing)
+        known.update(db.session.query(Skill.slug, Skill.id).filter(Skill.slug.in_([m['slug'] for m in missing])).all())
+    return [known[slug] for slug in slugs]
+
+def _sync_skills(link_model, owner_col, owner_id, text):
+    db.session.query(link_model).filter(owner_col == owner_id).delete(synchronize_session=False)
+    for skill_id in _skill_ids(_parse_skills(text)):
+        db.session.add(link_model(**{owner_col.key: owner_id, 'skill_id': skill_id}))
+
+# Profile fields that feed job matching (and the job feed)
+_MATCH_FIELDS = ('skills', 'experience_level', 'looking_for')
+
+def _index_user(user):
+    """Refresh the user's skill links and FTS row within the current transaction (caller commits).
+    Returns the set of changed matching fields; pass it on to _after_user_commit.
+    """
+    state = db.inspect(user)
+    changed = {name for name in _MATCH_FIELDS if state.attrs[name].history.has_changes()}
+    db.session.flush()
+    _sync_skills(UserSkill, UserSkill.user_id, user.id, user.skills)
+    _fts_index_user(user)
+    return changed
+
+def _index_job(job):
+    """Refresh the job's skill links and FTS row within the current transaction (caller commits)."""
+    db.session.flush()
+    _sync_skills(JobSkill, JobSkill.job_id, job.id, job.skills)
+    _fts_index_job(job)
+
+def _skill_by_name(name):
+    slug = _skill_slug(name)
+    return Skill.query.filter_by(slug=slug).first() if slug else None
+
+def _skill_facets(link_model, owner_col):
+    """[(name, count)] for every skill in use, counted with one GROUP BY over the link table."""
+    query = db.session.query(Skill.name, db.func.count(owner_col)).join(
+        link_model, link_model.skill_id == Skill.id
+    )
+    return sorted((tuple(row) for row in query.group_by(Skill.id)), key=lambda row: row[0].lower())
+
+def _value_facets(column):
+    """[(value, count)] of the distinct non-empty values of a User column."""
+    query = db.session.query(column, db.func.count(User.id)).filter(column.isnot(None), column != '')
+    return sorted((tuple(row) for row in query.group_by(column)), key=lambda row: row[0].lower())
+
+class _FacetCache:
+    """Versioned per-process cache for filter vocabularies.
+
+    Each scope ('users', 'jobs') has a version that writers bump after commit;
+    an entry built under an older version is rebuilt on next read. The TTL bounds
+    staleness for writes made by other worker processes.
+    """
+
+    def __init__(self, ttl_s):
+        self.ttl_s = ttl_s
+        self._versions = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scope, name, build):
+        key = (scope, name)
+        now = time.monotonic()
+        with self._lock:
+            version = self._versions.get(scope, 0)
+            entry = self._entries.get(key)
+            if entry and entry[0] == version and now - entry[1] < self.ttl_s:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        value = build()
+        with self._lock:
+            # Don't store a value built under a version that was bumped meanwhile
+            if self._versions.get(scope, 0) == version:
+                self._entries[key] = (version, now, value)
+        return value
+
+    def bump(self, scope):
+        with self._lock:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+                'versions': dict(self._versions),
+                'entries': len(self._entries),
+            }
+
+_facet_cache = _FacetCache(max(1, _env_int('FACET_CACHE_TTL', 60)))
+
+def _user_facets(exclude_user=None):
+    """Search dropdown vocabularies with counts; the viewer's own profile is subtracted."""
+    skills = _facet_cache.get('users', 'skills', lambda: _skill_facets(UserSkill, UserSkill.user_id))
+    levels = _facet_cache.get('users', 'experience', lambda: _value_facets(User.experience_level))
+    goals = _facet_cache.get('users', 'looking_for', lambda: _value_facets(User.looking_for))
+    if exclude_user is not None:
+        own = {slug for slug, _ in _parse_skills(exclude_user.skills)}
+        skills = _facets_minus(skills, lambda name: _skill_slug(name) in own)
+        levels = _facets_minus(levels, lambda value: value == exclude_user.experience_level)
+        goals = _facets_minus(goals, lambda value: value == exclude_user.looking_for)
+    return skills, levels, goals
+
+def _facets_minus(facets, is_own):
+    out = []
+    for value, count in facets:
+        if is_own(value):
+            count -= 1
+        if count > 0:
+            out.append((value, count))
+    return out
+
+def _job_facets():
+    return _facet_cache.get('jobs', 'skills', lambda: _skill_facets(JobSkill, JobSkill.job_id))
+
+class _SimilarUsersIndex:
+    """In-process inverted index skill slug -> user ids for "similar users".
+
+    Candidates are only the users sharing a skill, ranked by IDF-weighted Jaccard:
+    sum(idf(shared)) / sum(idf(union)), so rare shared skills count for more than
+    everyone's "Python". Built in a background thread (warmed at startup, rebuilt
+    after `ttl_s` to pick up edits made by other workers) and swapped in whole;
+    top() returns [] until the first build is done. Profile saves in this process
+    update it in place. Posting sets are replaced, never mutated, so top() scores
+    outside the lock.
+    """
+
+    def __init__(self, ttl_s, max_posting):
+        self.ttl_s = ttl_s
+        self.max_posting = max_posting
+        self._postings = {}  # slug -> frozenset of user ids
+        self._skills = {}  # user id -> frozenset of slugs
+        self._built_at = None
+        self._building = False
+        self._replay = {}  # updates made while a rebuild was reading user_skill
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Start a background (re)build unless one is already running."""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._replay = {}
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _ensure(self):
+        if self._built_at is None or time.monotonic() - self._built_at >= self.ttl_s:
+            self.warm()
+
+    def _rebuild(self):
+        postings, skills = {}, {}
+        try:
+            with app.app_context():
+                rows = db.session.query(UserSkill.user_id, Skill.slug).join(Skill, Skill.id == UserSkill.skill_id)
+                for user_id, slug in rows:
+                    postings.setdefault(slug, set()).add(user_id)
+                    skills.setdefault(user_id, set()).add(slug)
+        except Exception as e:
+            app.logger.warning('Similar users index build failed: %s', e)
+            with self._lock:
+                self._building = False
+            return
+        postings = {slug: frozenset(users) for slug, users in postings.items()}
+        skills = {uid: frozenset(v) for uid, v in skills.items()}
+        with self._lock:
+            self._postings, self._skills = postings, skills
+            for user_id, new in self._replay.items():
+                self._apply(user_id, new)
+            self._replay = {}
+            self._building = False
+            self._built_at = time.monotonic()
+
+    def _apply(self, user_id, new):
+        old = self._skills.get(user_id, frozenset())
+        for slug in old - new:
+            users = self._postings.get(slug, frozenset()) - {user_id}
+            if users:
+                self._postings[slug] = users
+            else:
+                self._postings.pop(slug, None)
+        for slug in new - old:
+            self._postings[slug] = self._postings.get(slug, frozenset()) | {user_id}
+        if new:
+            self._skills[user_id] = new
+        else:
+            self._skills.pop(user_id, None)
+
+    def update(self, user_id, skills_text):
+        """Replace one user's postings after their profile was committed."""
+        new = frozenset(slug for slug, _ in _parse_skills(skills_text))
+        with self._lock:
+            if self._building:
+                self._replay[user_id] = new
+            if self._built_at is not None:
+                self._apply(user_id, new)
+
+    def top(self, user_id, k, exclude=()):
+        """[(user_id, score)] of the k most similar users, best first."""
+        self._ensure()
+        with self._lock:
+            postings, skills = self._postings, self._skills
+        mine = skills.get(user_id)
+        if not mine:
+            return []
+        n = len(skills) + 1
+        idf = lambda slug: math.log(n / (1 + len(postings.get(slug, ())))) + 1.0
+        shared = {}
+        # Rarest skills first; a very common skill only adds candidates while we have too few
+        for slug in sorted(mine, key=lambda sl: len(postings.get(sl, ()))):
+            users = postings.get(slug, ())
+            if len(users) > self.max_posting and len(shared) >= k:
+                continue
+            w = idf(slug)
+            for other in users:
+                shared[other] = shared.get(other, 0.0) + w
+        skip = set(exclude) | {user_id}
+        mine_w = sum(idf(sl) for sl in mine)
+        scored = []
+        for other, inter in shared.items():
+            if other in skip:
+                continue
+            union = mine_w + sum(idf(sl) for sl in skills.get(other, ())) - inter
+            scored.append((inter / union if union else 0.0, -other))
+        return [(-neg_id, score) for score, neg_id in heapq.nlargest(k, scored)]
+
+_similar_users = _SimilarUsersIndex(max(1, _env_int('SIMILAR_USERS_TTL', 300)),
+                                    max(100, _env_int('SIMILAR_USERS_MAX_POSTING', 5000)))
+SIMILAR_USERS_K = max(1, _env_int('SIMILAR_USERS_K', 8))
+
+class _UsernamePrefixIndex:
+    """Sorted (lowercase username, id) list answering typeahead prefixes with bisect.
+
+    Built in a background thread (warmed at startup; prefix() finds nothing until
+    the first build is done), extended on registration, rebuilt after `ttl_s` so
+    users registered through other workers show up.
+    """
+
+    def __init__(self, ttl_s):
+        self.ttl_s = ttl_s
+        self._keys = []
+        self._built_at = None
+        self._building = False
+        self._pending = []  # registrations made while a rebuild was reading the user table
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Start a background (re)build unless one is already running."""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._pending = []
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _ensure(self):
+        if self._built_at is None or time.monotonic() - self._built_at >= self.ttl_s:
+            self.warm()
+
+    def _rebuild(self):
+        try:
+            with app.app_context():
+                keys = sorted((name.lower(), uid) for uid, name in db.session.query(User.id, User.username))
+        except Exception as e:
+            app.logger.warning('Username index build failed: %s', e)
+            with self._lock:
+                self._building = False
+            return
+        with self._lock:
+            self._keys = keys
+            for key in self._pending:
+                self._insert(key)
+            self._pending = []
+            self._building = False
+            self._built_at = time.monotonic()
+
+    def _insert(self, key):
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            self._keys.insert(i, key)
+
+    def add(self, user_id, username):
+        key = (username.lower(), user_id)
+        with self._lock:
+            if self._building:
+                self._pending.append(key)
+            if self._built_at is not None:
+                self._insert(key)
+
+    def prefix(self, text, limit, exclude=()):
+        """Ids of up to `limit` users whose username starts with `text`, alphabetical."""
+        self._ensure()
+        text = text.lower()
+        out = []
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (text,))
+            while i < len(self._keys) and len(out) < limit:
+                name, uid = self._keys[i]
+                if not name.startswith(text):
+                    break
+                if uid not in exclude:
+                    out.append(uid)
+                i += 1
+        return out
+
+_username_index = _UsernamePrefixIndex(max(1, _env_int('USERNAME_INDEX_TTL', 300)))
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _osa_distance(a, b, limit):
+    """Edit distance with adjacent transpositions ("pyhton" -> python = 1); limit + 1 once exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return min(prev[-1], limit + 1)
+
+class _TrigramIndex:
+    """Typo-tolerant lookup over a vocabulary (usernames, skill names).
+
+    Candidates are the terms sharing the most padded trigrams with the query,
+    collected from posting lists rarest-first (lists longer than `max_posting`
+    are skipped once rarer ones produced candidates) and capped at `candidates`;
+    only those are re-ranked by edit distance. Loaded in a background thread
+    (warmed at startup; lookup() finds nothing until the first load is done) and
+    extended on writes; every `ttl_s` only rows with an id above the last one seen
+    are loaded (terms are never renamed or deleted), which picks up inserts made
+    by other worker processes without rebuilding the whole vocabulary.
+    """
+
+    def __init__(self, load, ttl_s, max_posting=5000, candidates=64):
+        self._load = load  # (after_id) -> iterable of (id, term, value), ordered by id
+        self.ttl_s = ttl_s
+        self.max_posting = max_posting
+        self.candidates = candidates
+        self._terms = []
+        self._known = set()
+        self._postings = {}
+        self._built_at = None
+        self._max_id = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _index(self, terms, postings, known, term, value):
+        term = term.lower()
+        if not term or term in known:
+            return
+        known.add(term)
+        terms.append((term, value))
+        for gram in _trigrams(term):
+            postings.setdefault(gram, []).append(len(terms) - 1)
+
+    def warm(self):
+        """Load new rows in a background thread unless a load is already running."""
+        if not self._load_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _ensure(self):
+        if self._built_at is None or time.monotonic() - self._built_at >= self.ttl_s:
+            self.warm()
+
+    def _refresh(self):
+        try:
+            with app.app_context():
+                rows = list(self._load(self._max_id))
+            max_id = max([self._max_id] + [row_id for row_id, _, _ in rows])
+            if self._built_at is None:
+                # First load: indexed outside the lock and swapped in; add() is a no-op until
+                # then and the next load picks up anything inserted meanwhile
+                terms, postings, known = [], {}, set()
+                for _, term, value in rows:
+                    self._index(terms, postings, known, term, value)
+                with self._lock:
+                    self._terms, self._postings, self._known = terms, postings, known
+                    self._max_id, self._built_at = max_id, time.monotonic()
+                return
+            with self._lock:
+                for _, term, value in rows:
+                    self._index(self._terms, self._postings, self._known, term, value)
+                self._max_id, self._built_at = max_id, time.monotonic()
+        except Exception as e:
+            app.logger.warning('Trigram index load failed: %s', e)
+        finally:
+            self._load_lock.release()
+
+    def add(self, term, value):
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._index(self._terms, self._postings, self._known, term, value)
+
+    def lookup(self, text, limit=5):
+        """[(value, term)] closest to `text`, best first; [] for queries under 3 chars."""
+        q = ' '.join((text or '').lower().split())
+        if len(q) < 3:
+            return []
+        self._ensure()
+        grams = _trigrams(q)
+        max_d = 1 if len(q) <= 5 else 2
+        with self._lock:
+            counts = {}
+            for posting in sorted((self._postings.get(g, ()) for g in grams), key=len):
+                if len(posting) > self.max_posting and counts:
+                    continue
+                for tid in posting:
+                    counts[tid] = counts.get(tid, 0) + 1
+            best = heapq.nlargest(self.candidates, counts.items(), key=lambda kv: kv[1])
+            terms = [(self._terms[tid], shared) for tid, shared in best]
+        ranked = []
+        for (term, value), shared in terms:
+            # Whole term, or its beginning for long names ("pyhton" -> python_guru)
+            d = min(_osa_distance(q, term, max_d), _osa_distance(q, term[:len(q)], max_d))
+            dice = 2.0 * shared / (len(grams) + len(_trigrams(term)))
+            if d <= max_d or dice >= 0.6:
+                ranked.append((d, -dice, term, value))
+        ranked.sort()
+        return [(value, term) for _, _, term, value in ranked[:limit]]
+
+_username_trigrams = _TrigramIndex(
+    lambda after: db.session.query(User.id, User.username, User.id).filter(User.id > after).order_by(User.id),
+    max(1, _env_int('USERNAME_INDEX_TTL', 300))
+)
+_skill_trigrams = _TrigramIndex(
+    lambda after: db.session.query(Skill.id, Skill.slug, Skill.name).filter(Skill.id > after).order_by(Skill.id),
+    max(1, _env_int('USERNAME_INDEX_TTL', 300))
+)
+
+def _warm_indexes():
+    """Build the in-process search indexes in background threads, so no request waits for them."""
+    for index in (_similar_users, _username_index, _username_trigrams, _skill_trigrams):
+        index.warm()
+
+def _fuzzy_user_filter(text, skill_text=''):
+    """(SQL condition, [corrected terms]) for users whose name or skills are close to
+    the misspelled input, or (None, []) when nothing is close enough."""
+    conds, corrected = [], []
+    ids = [uid for uid, _ in _username_trigrams.lookup(text)] if text else []
+    if ids:
+        conds.append(User.id.in_(ids))
+        corrected.extend(name for name, in db.session.query(User.username).filter(User.id.in_(ids)))
+    for name in {name for source in (text, skill_text) if source for name, _ in _skill_trigrams.lookup(source, limit=1)}:
+        skill = _skill_by_name(name)
+        if skill:
+            conds.append(User.id.in_(db.select(UserSkill.user_id).where(UserSkill.skill_id == skill.id)))
+            corrected.append(skill.name)
+    if not conds:
+        return None, []
+    return db.or_(*conds), corrected
+API_SEARCH_MAX_AGE = max(0, _env_int('API_SEARCH_MAX_AGE', 30))
+API_SEARCH_FALLBACK_MIN_CHARS = max(1, _env_int('API_SEARCH_FALLBACK_MIN_CHARS', 3))
+
+def _after_user_commit(user, changed=()):
+    """Refresh in-process search structures once a user's profile change is committed.
+    `changed` is what _index_user returned: matches and the feed are only redone for those."""
+    if changed:
+        _queue_match_refresh(user_id=user.id)
+    _facet_cache.bump('users')
+    _similar_users.update(user.id, user.skills)
+    for slug, name in _parse_skills(user.skills):
+        _skill_trigrams.add(slug, name)
+    if 'skills' in changed:
+        _queue_feed_task(_reseed_feed, user.id)
+
+def _backfill_skills():
+    """Populate the link tables from the comma-separated strings for rows that have none yet."""
+    for model, link_model, owner_col in ((User, UserSkill, UserSkill.user_id),
+                                         (FreelanceJob, JobSkill, JobSkill.job_id)):
+        linked = db.session.query(owner_col)
+        rows = model.query.filter(model.skills.isnot(None), model.skills != '', ~model.id.in_(linked)).all()
+        for row in rows:
+            _sync_skills(link_model, owner_col, row.id, row.skills)
+        if rows:
+            app.logger.info('Skill backfill: linked %d %s rows', len(rows), model.__tablename__)
+    db.session.commit()
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -800,7 +2107,8 @@ def index():
     if current_user.is_authenticated:
         # Показываем других пользователей для знакомства
         other_users = User.query.filter(User.id != current_user.id).limit(20).all()
-        return render_template('index.html', users=other_users)
+        feed_jobs, _ = _feed_page(current_user.id, limit=6)
+        return render_template('index.html', users=other_users, feed_jobs=feed_jobs)
     return render_template('index.html')
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -845,7 +2153,11 @@ def register():
         )
         
         db.session.add(user)
+        _index_user(user)
         db.session.commit()
+        _after_user_commit(user)
+        _username_index.add(user.id, user.username)
+        _username_trigrams.add(user.username, user.id)
         
         login_user(user)
         # clear any rate limit record for this IP on success
@@ -930,7 +2242,9 @@ def edit_profile():
         file = (request.files.get('avatar') if 'avatar' in request.files else None)
         if file and file.filename:
             if not _is_allowed_avatar(file.filename):
+                changed = _index_user(current_user)
                 db.session.commit()
+                _after_user_commit(current_user, changed)
                 flash('Недопустимый формат файла. Разрешены: PNG, JPG, JPEG, GIF, WEBP')
                 return redirect(url_for('edit_profile'))
             fn = secure_filename(file.filename)
@@ -951,35 +2265,54 @@ def edit_profile():
                 current_user.avatar_url = f"/uploads/avatars/{safe_name}"
             except Exception as e:
                 app.logger.error('Avatar upload failed: %s', e)
+                changed = _index_user(current_user)
                 db.session.commit()
+                _after_user_commit(current_user, changed)
                 flash('Не удалось сохранить аватар. Попробуйте еще раз.')
                 return redirect(url_for('edit_profile'))
 
+        changed = _index_user(current_user)
         db.session.commit()
+        _after_user_commit(current_user, changed)
         flash('Профиль обновлен!')
         return redirect(url_for('profile'))
     
     return render_template('edit_profile.html')
 
+# One chat per canonical (pair_lo, pair_hi); a losing concurrent INSERT re-selects the winner's row
+def _get_or_create_chat(a_id, b_id):
+    """Chat for the pair, creating it once. Concurrent first opens resolve to one row via ux_chat_pair.
+    One seek on ux_chat_pair; the row itself is needed anyway for the read watermarks."""
+    pair = (min(a_id, b_id), max(a_id, b_id))
+    chat = Chat.query.filter_by(pair_lo=pair[0], pair_hi=pair[1]).first()
+    if not chat:
+        chat = Chat(user1_id=a_id, user2_id=b_id, pair_lo=pair[0], pair_hi=pair[1])
+        db.session.add(chat)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request created it first
+            db.session.rollback()
+            chat = Chat.query.filter_by(pair_lo=pair[0], pair_hi=pair[1]).first()
+            if chat is None:
+                # Not a pair race (some other constraint failed): don't hide it
+                raise
+    _chat_members_cache.set(chat.id, (chat.user1_id, chat.user2_id))
+    return chat
+
 @app.route('/chat/<int:user_id>')
 @login_required
 def chat(user_id):
     other_user = User.query.get_or_404(user_id)
     
     # Найти или создать чат
-    chat = Chat.query.filter(
-        ((Chat.user1_id == current_user.id) & (Chat.user2_id == user_id)) |
-        ((Chat.user1_id == user_id) & (Chat.user2_id == current_user.id))
-    ).first()
-    
-    if not chat:
-        chat = Chat(user1_id=current_user.id, user2_id=user_id)
-        db.session.add(chat)
-        db.session.commit()
+    chat = _get_or_create_chat(current_user.id, user_id)
     
-    messages = Message.query.filter_by(chat_id=chat.id).order_by(Message.timestamp).all()
+    # Только последняя страница; более ранние подгружаются по before_id при прокрутке
+    messages, has_more = _history_page(chat.id)
     
-    return render_template('chat.html', other_user=other_user, messages=messages, chat_id=chat.id)
+    return render_template('chat.html', other_user=other_user, messages=messages, chat_id=chat.id, has_more=has_more,
+                           peer_read_up_to=_peer_read_mark(chat, current_user.id))
 
 @app.route('/chat/ai')
 @login_required
@@ -987,6 +2320,74 @@ def chat_ai():
     # Новый самостоятельный AI-чат без БД
     return render_template('ai_chat.html')
 
+# Streaming AI replies (SSE): deltas are forwarded as the provider produces them.
+# The session cookie is already sent when the stream starts, so the final reply
+# comes back signed in the `done` event and the page commits it via /api/ai_history.
+AI_HISTORY_COMMIT_MAX_AGE = _env_int('AI_HISTORY_COMMIT_MAX_AGE', 600)
+
+def _wants_stream(data):
+    return bool(data.get('stream')) or 'text/event-stream' in (request.headers.get('Accept') or '')
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _sse_response(events):
+    resp = Response(stream_with_context(events), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # nginx: don't buffer the stream
+    return resp
+
+def _ai_commit_serializer():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='ai-history')
+
+def _ai_commit_token(history, reply):
+    """Signed "append `reply` after the current last history item" for /api/ai_history."""
+    after = history[-1].get('content') if history else None
+    return _ai_commit_serializer().dumps({'u': current_user.id, 'after': after, 'reply': reply})
+
+def _ai_compose_reply(content, history, llm_text, soft_guard=''):
+    """Final assistant message: LLM text (or a local fallback) plus site suggestions not shown last time."""
+    last_assistant = None
+    for h in reversed(history):
+        if h.get('role') == 'assistant':
+            last_assistant = h.get('content') or ''
+            break
+    if llm_text:
+        text = llm_text.strip()
+        sug = _site_suggestions(content + ' ' + text)
+    else:
+        # Фоллбек на локальные подсказки (без жёсткой блокировки тем)
+        # Сначала пытаемся дать осмысленный ответ локально (ключевые слова/правила)
+        local = (generate_ai_reply(content) or '').strip()
+        # Tailor message depending on known provider errors
+        err_code = getattr(g, 'llm_error_code', None)
+        if not local:
+            if err_code == 429:
+                text = (
+                    'Похоже, достигнут лимит запросов к AI (429 Too Many Requests). '\
+                    'Сделайте паузу 10–20 секунд и повторите. Я всё равно помогу: '\
+                    'кратко опишите цель, стек и что уже пробовали.'
+                )
+            elif err_code in (401, 403):
+                text = (
+                    'Пока нет доступа к AI (ошибка авторизации). Я помогу без модели: '\
+                    'опишите цель, стек и что уже пробовали — предложу шаги.'
+                )
+            else:
+                text = (
+                    'Сейчас не удалось обратиться к модели. Давайте всё равно продвинемся: '\
+                    'кратко опишите цель, какой стек используете, и что уже пробовали. '
+                    'Если это вопрос по DevConnect — укажите раздел и что хотите сделать.'
+                )
+        else:
+            text = local
+        sug = _site_suggestions(content)
+    # Избежать повторяющегося guard/подсказок
+    guard_prefix = '' if (soft_guard and last_assistant and soft_guard in last_assistant) else soft_guard
+    sug_part = '' if (sug and last_assistant and sug in last_assistant) else (("\n\n" + sug) if sug else '')
+    body = text + sug_part
+    return (guard_prefix + ('\n\n' if guard_prefix else '')) + body
+
 @app.route('/api/ai_reply', methods=['POST'])
 @login_required
 def api_ai_reply():
@@ -1012,7 +2413,8 @@ def api_ai_reply():
         sug = _site_suggestions(content)
         reply = st + (('\n\n' + sug) if sug else '')
         history.append({'role': 'assistant', 'content': reply})
-        history = history[-30:]
+        # Тот же бюджет токенов, что и для ответов модели: старые реплики сворачиваются в резюме
+        _, history = _ai_context(history)
         _ai_history_set(history)
         return jsonify({'status': 'ok', 'reply': reply})
 
@@ -1023,22 +2425,14 @@ def api_ai_reply():
     # Темы контролируем системным промптом. Если сообщение вне тем, не блокируем, а добавим мягкое напоминание к ответу.
     soft_guard = ''
 
-    # История диалога из сессии (ограничим длину)
+    # История диалога из сессии
     history = _ai_history_get()
     # Добавляем текущее сообщение пользователя
     history.append({'role': 'user', 'content': content})
-    # Ограничим последние 30 записей, чтобы не раздувать контекст
-    history = history[-30:]
 
-    # Сформируем сообщения с системным промптом
-    kb = _load_site_knowledge()
-    sys_msgs = [{'role': 'system', 'content': _build_system_prompt()}]
-    if kb:
-        sys_msgs.append({'role': 'system', 'content': 'Справка о сайте DevConnect:\n' + kb})
-    routes = _route_summary()
-    if routes:
-        sys_msgs.append({'role': 'system', 'content': 'Карта маршрутов (сокращённо):\n' + routes})
-    messages = sys_msgs + _few_shots() + history
+    # Системный контекст (собран заранее) + резюме + история в пределах AI_PROMPT_BUDGET;
+    # старые реплики сворачиваются в резюме
+    messages, history = _ai_context(history)
 
     # Попытка LLM с учетом контекста
     # Record last call timestamp before contacting LLM to pace subsequent requests
@@ -1046,73 +2440,58 @@ def api_ai_reply():
         session['ai_last_call'] = now_ts
     except Exception:
         pass
-    llm = _llm_chat(messages)
-    if llm:
-        text = llm.strip()
-        # Предыдущий ответ ассистента (для анти-повтора)
-        last_assistant = None
-        for h in reversed(history):
-            if h.get('role') == 'assistant':
-                last_assistant = h.get('content') or ''
-                break
-        sug = _site_suggestions(content + ' ' + text)
-        # Избежать повторяющегося guard/подсказок
-        guard_prefix = '' if (soft_guard and last_assistant and soft_guard in last_assistant) else soft_guard
-        sug_part = '' if (sug and last_assistant and sug in last_assistant) else (("\n\n" + sug) if sug else '')
-        body = text + sug_part
-        reply = (guard_prefix + ('\n\n' if guard_prefix else '')) + body
-        history.append({'role': 'assistant', 'content': reply})
+    use_cache = not _llm_cache_opt_out(data)
+    if _wants_stream(data):
+        # Сохраняем вопрос сейчас: после начала потока cookie-сессию уже не обновить
         _ai_history_set(history)
-        return jsonify({'status': 'ok', 'reply': reply})
 
-    # Фоллбек на локальные подсказки (без жёсткой блокировки тем)
-    # Сначала пытаемся дать осмысленный ответ локально (ключевые слова/правила)
-    local = (generate_ai_reply(content) or '').strip()
-    # Tailor message depending on known provider errors
-    err_code = getattr(g, 'llm_error_code', None)
-    if not local:
-        if err_code == 429:
-            fb = (
-                'Похоже, достигнут лимит запросов к AI (429 Too Many Requests). '\
-                'Сделайте паузу 10–20 секунд и повторите. Я всё равно помогу: '\
-                'кратко опишите цель, стек и что уже пробовали.'
-            )
-        elif err_code in (401, 403):
-            fb = (
-                'Пока нет доступа к AI (ошибка авторизации). Я помогу без модели: '\
-                'опишите цель, стек и что уже пробовали — предложу шаги.'
-            )
-        else:
-            fb = (
-                'Сейчас не удалось обратиться к модели. Давайте всё равно продвинемся: '\
-                'кратко опишите цель, какой стек используете, и что уже пробовали. '
-                'Если это вопрос по DevConnect — укажите раздел и что хотите сделать.'
-            )
-    else:
-        fb = local
-    sug = _site_suggestions(content)
-    last_assistant = None
-    for h in reversed(history):
-        if h.get('role') == 'assistant':
-            last_assistant = h.get('content') or ''
-            break
-    guard_prefix = '' if (soft_guard and last_assistant and soft_guard in last_assistant) else soft_guard
-    sug_part = '' if (sug and last_assistant and sug in last_assistant) else (("\n\n" + sug) if sug else '')
-    body = fb + sug_part
-    reply = (guard_prefix + ('\n\n' if guard_prefix else '')) + body
+        def events():
+            parts = []
+            for delta in _llm_chat_stream(messages, cache=use_cache):
+                parts.append(delta)
+                yield _sse('delta', {'text': delta})
+            reply = _ai_compose_reply(content, history, ''.join(parts), soft_guard)
+            yield _sse('done', {'status': 'ok', 'reply': reply, 'commit': _ai_commit_token(history, reply)})
+        return _sse_response(events())
+
+    llm = _llm_chat(messages, cache=use_cache)
+    reply = _ai_compose_reply(content, history, llm, soft_guard)
     history.append({'role': 'assistant', 'content': reply})
     _ai_history_set(history)
     return jsonify({'status': 'ok', 'reply': reply})
 
+@app.route('/api/ai_history', methods=['POST'])
+@login_required
+def api_ai_history():
+    """Append a streamed reply to the session history (token from the stream's `done` event)."""
+    data = request.get_json(silent=True) or {}
+    try:
+        commit = _ai_commit_serializer().loads(data.get('commit') or '', max_age=AI_HISTORY_COMMIT_MAX_AGE)
+    except BadSignature:
+        return jsonify({'status': 'error', 'error': 'bad_commit'}), 400
+    if commit.get('u') != current_user.id:
+        return jsonify({'status': 'error', 'error': 'bad_commit'}), 400
+    history = _ai_history_get()
+    after = history[-1].get('content') if history else None
+    # Only if nothing else was appended meanwhile (reset, another tab, repeated commit)
+    if after != commit.get('after'):
+        return jsonify({'status': 'ok', 'committed': False})
+    history.append({'role': 'assistant', 'content': commit.get('reply') or ''})
+    _ai_history_set(history)
+    return jsonify({'status': 'ok', 'committed': True})
+
 @app.route('/api/ai_check', methods=['GET'])
 @login_required
 def api_ai_check():
     cfg = _get_ai_cfg() or {}
+    bundle = _prompt_bundle()
     info = {
         'provider': cfg.get('provider', ''),
         'model': cfg.get('model') or cfg.get('deployment', ''),
         'has_key': bool(cfg.get('key')),
         'rate_limit': _ai_rate_limit_seconds(),
+        'prompt_version': bundle.version,
+        'prompt_tokens': bundle.tokens,
     }
     code = getattr(g, 'llm_error_code', None)
     if code is not None:
@@ -1124,6 +2503,7 @@ def api_ai_check():
 def api_ai_reset():
     try:
         session['ai_history'] = []
+        session['ai_summary'] = ''
     except Exception:
         pass
     return jsonify({'status': 'ok'})
@@ -1146,18 +2526,8 @@ def api_ai_suggest():
     if rl > 0 and (now_ts - last_ts) < rl:
         return jsonify({'status': 'ok', 'reply': 'Секунду… Давайте не слишком часто запрашивать подсказки, чтобы не упереться в лимиты.'})
 
-    # Load recent history (keep last 30 items)
     history = _ai_history_get() or []
-    history = history[-30:]
 
-    # Build system context
-    kb = _load_site_knowledge()
-    sys_msgs = [{'role': 'system', 'content': _build_system_prompt()}]
-    if kb:
-        sys_msgs.append({'role': 'system', 'content': 'Справка о сайте DevConnect:\n' + kb})
-    routes = _route_summary()
-    if routes:
-        sys_msgs.append({'role': 'system', 'content': 'Карта маршрутов (сокращённо):\n' + routes})
 
     # Add a short guiding prompt to move the dialog forward within scope
     guide = (
@@ -1165,19 +2535,37 @@ def api_ai_suggest():
         'задай уточняющий вопрос ИЛИ предложи 2–3 шага/варианта действий по теме. Кратко и по делу. '
         'Не повторяйся и не перефразируй предыдущий ответ.'
     )
-    messages = sys_msgs + _few_shots() + history + [{'role': 'user', 'content': guide}]
+    messages, history = _ai_context(history, extra=[{'role': 'user', 'content': guide}])
+
+    fallback = (
+        'Предлагаю продолжить: уточните цель, стек (например, Flask/React/SQL), и что уже пробовали. '
+        'Могу наметить чек-лист шагов и дать ссылки на разделы сайта.'
+    )
+    data = request.get_json(silent=True) or {}
+    use_cache = not _llm_cache_opt_out(data)
+    if _wants_stream(data):
+        # Без повторной попытки при дубле: первые токены уже у пользователя
+        def events():
+            parts = []
+            for delta in _llm_chat_stream(messages, cache=use_cache):
+                parts.append(delta)
+                yield _sse('delta', {'text': delta})
+            text = ''.join(parts).strip() or fallback
+            last_assistant = next((h.get('content') or '' for h in reversed(history) if h.get('role') == 'assistant'), None)
+            sug = _site_suggestions(text)
+            sug_part = '' if (sug and last_assistant and sug in last_assistant) else (('\n\n' + sug) if sug else '')
+            reply = text + sug_part
+            yield _sse('done', {'status': 'ok', 'reply': reply, 'commit': _ai_commit_token(history, reply)})
+        return _sse_response(events())
 
     # Try LLM
     text = None
-    llm = _llm_chat(messages)
+    llm = _llm_chat(messages, cache=use_cache)
     if llm:
         text = llm.strip()
     else:
         # Fallback if LLM unavailable
-        text = (
-            'Предлагаю продолжить: уточните цель, стек (например, Flask/React/SQL), и что уже пробовали. '
-            'Могу наметить чек-лист шагов и дать ссылки на разделы сайта.'
-        )
+        text = fallback
 
     # Anti-duplicate: compare with last assistant message
     last_assistant = None
@@ -1191,7 +2579,7 @@ def api_ai_suggest():
         # Retry once with a stronger anti-repeat hint
         retry_guide = 'Сформируй новый ответ, отличный от предыдущего. Добавь свежие идеи/шаги. Не повторяй формулировки.'
         retry_msgs = messages + [{'role': 'user', 'content': retry_guide}]
-        llm2 = _llm_chat(retry_msgs)
+        llm2 = _llm_chat(retry_msgs, cache=False)
         if llm2:
             text = llm2.strip()
     # Optionally add site suggestions (avoid repeating same suggestions)
@@ -1201,7 +2589,6 @@ def api_ai_suggest():
 
     # Save assistant reply to history
     history.append({'role': 'assistant', 'content': reply})
-    history = history[-30:]
     _ai_history_set(history)
 
     return jsonify({'status': 'ok', 'reply': reply})
@@ -1228,7 +2615,7 @@ def send_message():
     if not chat:
         db.session.rollback()
         return jsonify({'status': 'error', 'error': 'chat_not_found'}), 404
-    chat.last_message_at = datetime.utcnow()
+    _record_chat_message(chat, message)
 
     db.session.commit()
 
@@ -1237,37 +2624,25 @@ def send_message():
 
     response_payload = {
         'status': 'success',
-        'message': {
-            'id': message.id,
-            'sender_id': message.sender_id,
-            'content': message.content,
-            'timestamp': message.timestamp.strftime('%H:%M'),
-            'sender_username': message.sender.username,
-            'is_read': message.is_read
-        }
+        'message': _message_payload(message, chat)
     }
 
     if ai and ai.id in chat_users and current_user.id in chat_users:
-        reply = Message(
-            chat_id=chat_id,
-            sender_id=ai.id,
-            content=generate_ai_reply(content)
-        )
-        db.session.add(reply)
-        chat.last_message_at = datetime.utcnow()
-        db.session.commit()
-
-        response_payload['messages'] = [
-            response_payload['message'],
-            {
-                'id': reply.id,
-                'sender_id': reply.sender_id,
-                'content': reply.content,
-                'timestamp': reply.timestamp.strftime('%H:%M'),
-                'sender_username': reply.sender.username,
-                'is_read': reply.is_read
-            }
-        ]
+        # Ответ DevBot генерируется в фоне и приходит через message:new
+        response_payload['bot_pending'] = _queue_ai_reply(chat.id, ai.id, content)
+        if not response_payload['bot_pending']:
+            reply = Message(
+                chat_id=chat_id,
+                sender_id=ai.id,
+                content='DevBot сейчас перегружен запросами. Попробуйте повторить вопрос через минуту.'
+            )
+            db.session.add(reply)
+            _record_chat_message(chat, reply)
+            db.session.commit()
+            response_payload['messages'] = [
+                response_payload['message'],
+                _message_payload(reply, chat)
+            ]
 
     # Emit real-time events to the chat room
     try:
@@ -1282,58 +2657,184 @@ def send_message():
 
     return jsonify(response_payload)
 
+def _read_mark(chat, user_id):
+    """Read watermark (last read message id) of `user_id` in `chat`."""
+    if chat.user1_id == user_id:
+        return chat.last_read_user1 or 0
+    return chat.last_read_user2 or 0
+
+def _peer_read_mark(chat, user_id):
+    """Read watermark of the other participant, i.e. how far `user_id`'s messages were read."""
+    other_id = chat.user2_id if chat.user1_id == user_id else chat.user1_id
+    return _read_mark(chat, other_id)
+
+def _message_payload(msg, chat):
+    return {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'content': msg.content,
+        'timestamp': msg.timestamp.strftime('%H:%M'),
+        'sender_username': msg.sender.username,
+        # Прочитано, если id не выше водяного знака получателя
+        'is_read': msg.id <= _peer_read_mark(chat, msg.sender_id)
+    }
+
+def _parse_after_ts(value):
+    """Parse `after_ts` cursor: ISO 8601 string or unix seconds. Returns naive UTC datetime or None."""
+    v = (value or '').strip()
+    if not v:
+        return None
+    try:
+        return datetime.utcfromtimestamp(float(v))
+    except (TypeError, ValueError, OverflowError, OSError):
+        pass
+    try:
+        ts = datetime.fromisoformat(v.replace('Z', '+00:00'))
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+        return ts
+    except ValueError:
+        return None
+
+def _record_chat_message(chat, message):
+    """Update the chat's inbox summary for a new message (caller commits)."""
+    db.session.flush()
+    chat.last_message_at = message.timestamp or datetime.utcnow()
+    chat.last_message_id = message.id
+    chat.last_message_preview = (message.content or '')[:120]
+    chat.last_sender_id = message.sender_id
+    # Counter increments happen in SQL so concurrent senders don't lose updates
+    if message.sender_id == chat.user1_id:
+        chat.unread_user2 = Chat.unread_user2 + 1
+    else:
+        chat.unread_user1 = Chat.unread_user1 + 1
+
+def _mark_chat_read(chat):
+    """Advance current user's read watermark to the chat's last message with one UPDATE.
+    Notifies the room and returns the new watermark, or None if nothing changed.
+    """
+    up_to = chat.last_message_id or 0
+    if current_user.id == chat.user1_id:
+        mark_col, unread_col = Chat.last_read_user1, 'unread_user1'
+    elif current_user.id == chat.user2_id:
+        mark_col, unread_col = Chat.last_read_user2, 'unread_user2'
+    else:
+        return None
+    if _read_mark(chat, current_user.id) >= up_to:
+        return None
+    updated = Chat.query.filter(Chat.id == chat.id, mark_col < up_to).update(
+        {mark_col.key: up_to, unread_col: 0}, synchronize_session=False)
+    db.session.commit()
+    if not updated:
+        return None
+    # notify room about read receipts
+    try:
+        socketio.emit('message:read', {
+            'reader_id': current_user.id,
+            'up_to_id': up_to
+        }, room=f"chat_{chat.id}")
+    except Exception:
+        pass
+    return up_to
+
+def _history_page(chat_id, before_id=None, limit=None):
+    """Newest `limit` messages of a chat older than `before_id`, oldest first.
+    Keyset over (timestamp, id), so deep pages cost the same as the first one.
+    Returns (messages, has_more).
+    """
+    limit = limit or CHAT_PAGE_SIZE
+    q = Message.query.filter(Message.chat_id == chat_id)
+    if before_id:
+        anchor = db.session.query(Message.timestamp).filter(
+            Message.id == before_id, Message.chat_id == chat_id
+        ).scalar()
+        if anchor is None:
+            q = q.filter(Message.id < before_id)
+        else:
+            q = q.filter(db.or_(
+                Message.timestamp < anchor,
+                db.and_(Message.timestamp == anchor, Message.id < before_id)
+            ))
+    rows = q.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_more
+
 @app.route('/get_messages/<int:chat_id>')
 @login_required
 def get_messages(chat_id):
-    messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.timestamp).all()
-
-    # Mark as read messages received by current user
-    to_mark = [m for m in messages if m.sender_id != current_user.id and not m.is_read]
-    read_ids = [m.id for m in to_mark]
-    if to_mark:
-        for m in to_mark:
-            m.is_read = True
-        db.session.commit()
-        # notify room about read receipts
-        try:
-            socketio.emit('message:read', {
-                'reader_id': current_user.id,
-                'message_ids': read_ids
-            }, room=f"chat_{chat_id}")
-        except Exception:
-            pass
-
-    messages_data = []
-    for msg in messages:
-        messages_data.append({
-            'id': msg.id,
-            'sender_id': msg.sender_id,
-            'content': msg.content,
-            'timestamp': msg.timestamp.strftime('%H:%M'),
-            'sender_username': msg.sender.username,
-            'is_read': msg.is_read
+    chat = Chat.query.get(chat_id)
+    if not chat:
+        return jsonify({'status': 'error', 'error': 'chat_not_found'}), 404
+    if current_user.id not in (chat.user1_id, chat.user2_id):
+        return jsonify({'status': 'error', 'error': 'forbidden'}), 403
+
+    since_id = request.args.get('since_id', type=int)
+    after_ts = _parse_after_ts(request.args.get('after_ts'))
+    before_id = request.args.get('before_id', type=int)
+    limit = max(1, min(request.args.get('limit', CHAT_PAGE_SIZE, type=int), CHAT_PAGE_MAX))
+
+    # Older page for infinite scroll: keyset cursor on (timestamp, id)
+    if before_id is not None:
+        messages, has_more = _history_page(chat_id, before_id=before_id, limit=limit)
+        return jsonify({
+            'messages': [_message_payload(msg, chat) for msg in messages],
+            'has_more': has_more,
+            'before_id': messages[0].id if messages else before_id
         })
 
-    return jsonify(messages_data)
+    # Mark incoming messages as read: one UPDATE of the watermark
+    _mark_chat_read(chat)
+
+    # Без курсора — последняя страница истории списком
+    if since_id is None and after_ts is None:
+        messages, _ = _history_page(chat_id, limit=limit)
+        return jsonify([_message_payload(msg, chat) for msg in messages])
+
+    # Delta mode: only rows newer than the client's cursor, in cursor (id) order; at most
+    # CHAT_PAGE_MAX per call, has_more tells the client to fetch again from last_id
+    q = Message.query.filter(Message.chat_id == chat_id)
+    if since_id is not None:
+        q = q.filter(Message.id > since_id)
+    if after_ts is not None:
+        q = q.filter(Message.timestamp > after_ts)
+    messages = q.order_by(Message.id).limit(CHAT_PAGE_MAX + 1).all()
+    has_more = len(messages) > CHAT_PAGE_MAX
+    messages = messages[:CHAT_PAGE_MAX]
+
+    last_id = messages[-1].id if messages else since_id
+    return jsonify({
+        'messages': [_message_payload(msg, chat) for msg in messages],
+        'last_id': last_id,
+        'has_more': has_more,
+        # Read state of own messages: highest own message id the peer has read
+        'read_up_to': _peer_read_mark(chat, current_user.id)
+    })
 
 @app.route('/chats')
 @login_required
 def chats():
-    # Получить все чаты пользователя
-    user_chats = Chat.query.filter(
-        (Chat.user1_id == current_user.id) | (Chat.user2_id == current_user.id)
+    # Весь инбокс одним запросом: чат + собеседник, сводка хранится в самой строке chat
+    me = current_user.id
+    other_id = db.case((Chat.user1_id == me, Chat.user2_id), else_=Chat.user1_id)
+    rows = db.session.query(Chat, User).join(User, User.id == other_id).filter(
+        (Chat.user1_id == me) | (Chat.user2_id == me)
     ).order_by(Chat.last_message_at.desc()).all()
     
     chats_data = []
-    for chat in user_chats:
-        other_user = chat.user1 if chat.user1_id != current_user.id else chat.user2
-        last_message = Message.query.filter_by(chat_id=chat.id).order_by(Message.timestamp.desc()).first()
+    for chat, other_user in rows:
+        last_message = None
+        if chat.last_message_id:
+            last_message = {'id': chat.last_message_id, 'sender_id': chat.last_sender_id,
+                            'content': chat.last_message_preview or ''}
         
         chats_data.append({
             'chat_id': chat.id,
             'other_user': other_user,
             'last_message': last_message,
-            'last_message_at': chat.last_message_at
+            'last_message_at': chat.last_message_at,
+            'unread': (chat.unread_user1 if chat.user1_id == me else chat.unread_user2) or 0
         })
     return render_template('chats.html', chats=chats_data)
 @app.route('/search')
@@ -1345,38 +2846,48 @@ def search():
     looking_for_filter = request.args.get('looking_for', '').strip()
     
     # Базовый запрос - исключаем текущего пользователя
-    users_query = User.query.filter(User.id != current_user.id)
-    
-    # Поиск по никнейму
-    if query:
-        users_query = users_query.filter(User.username.ilike(f'%{query}%'))
-    
-    # Фильтр по навыкам
-    if skill_filter:
-        users_query = users_query.filter(User.skills.ilike(f'%{skill_filter}%'))
+    base_query = User.query.filter(User.id != current_user.id)
     
     # Фильтр по опыту
     if experience_filter:
-        users_query = users_query.filter(User.experience_level == experience_filter)
+        base_query = base_query.filter(User.experience_level == experience_filter)
     
     # Фильтр по целям
     if looking_for_filter:
-        users_query = users_query.filter(User.looking_for == looking_for_filter)
+        base_query = base_query.filter(User.looking_for == looking_for_filter)
+    
+    # Известный навык фильтруется точно по индексу user_skill, произвольный текст — как префикс.
+    # Точный фильтр входит в base_query, чтобы действовать и для поиска с опечатками
+    skill = _skill_by_name(skill_filter) if skill_filter else None
+    if skill:
+        base_query = base_query.filter(
+            User.id.in_(db.session.query(UserSkill.user_id).filter(UserSkill.skill_id == skill.id))
+        )
+    
+    users_query = base_query
+    
+    # Поиск по никнейму/био/навыкам (FTS5, ранжирование bm25, префиксы)
+    fts = _user_fts_ranked(query, '' if skill else skill_filter)
+    if fts is not None:
+        users_query = users_query.join(fts, User.id == fts.c.user_id).order_by(fts.c.score)
+    else:
+        if query:
+            users_query = users_query.filter(User.username.ilike(f'%{query}%'))
+        # Фильтр по навыкам
+        if skill_filter and not skill:
+            users_query = users_query.filter(User.skills.ilike(f'%{skill_filter}%'))
     
     users = users_query.limit(50).all()
     
-    # Получаем уникальные значения для фильтров
-    all_skills = set()
-    all_experience_levels = set()
-    all_looking_for = set()
+    # Ничего не нашлось — пробуем исправить опечатку (триграммы + расстояние правки)
+    corrected = []
+    if not users and (query or (skill_filter and not skill)):
+        fuzzy, corrected = _fuzzy_user_filter(query, '' if skill else skill_filter)
+        if fuzzy is not None:
+            users = base_query.filter(fuzzy).limit(50).all()
     
-    for user in User.query.filter(User.id != current_user.id).all():
-        if user.skills:
-            all_skills.update([skill.strip() for skill in user.skills.split(',')])
-        if user.experience_level:
-            all_experience_levels.add(user.experience_level)
-        if user.looking_for:
-            all_looking_for.add(user.looking_for)
+    # Значения для фильтров с количеством: кэш по версии, без запроса к таблице users
+    all_skills, all_experience_levels, all_looking_for = _user_facets(exclude_user=current_user)
     
     return render_template('search.html', 
                          users=users, 
@@ -1384,9 +2895,11 @@ def search():
                          skill_filter=skill_filter,
                          experience_filter=experience_filter,
                          looking_for_filter=looking_for_filter,
-                         all_skills=sorted(all_skills),
-                         all_experience_levels=sorted(all_experience_levels),
-                         all_looking_for=sorted(all_looking_for))
+                         corrected=corrected if users else [],
+                         fallback_min_chars=API_SEARCH_FALLBACK_MIN_CHARS,
+                         all_skills=all_skills,
+                         all_experience_levels=all_experience_levels,
+                         all_looking_for=all_looking_for)
 
 @app.route('/api/search')
 @login_required
@@ -1395,10 +2908,27 @@ def api_search():
     if not query:
         return jsonify([])
     
-    users = User.query.filter(
-        User.id != current_user.id,
-        User.username.ilike(f'%{query}%')
-    ).limit(10).all()
+    # Префикс ника — только из индекса в памяти, без SQL. Запасной поиск (FTS, инфикс LIKE,
+    # опечатки) — лишь по ?fallback=1: клиент шлёт его после паузы, когда префикс пуст
+    ids = _username_index.prefix(query, 10, exclude={current_user.id})
+    by_id = {u.id: u for u in User.query.filter(User.id.in_(ids))} if ids else {}
+    users = [by_id[uid] for uid in ids if uid in by_id]
+    if not users and request.args.get('fallback') == '1' and len(query) >= API_SEARCH_FALLBACK_MIN_CHARS:
+        fts = _user_fts_ranked(query)
+        if fts is not None:
+            users = User.query.join(fts, User.id == fts.c.user_id).filter(
+                User.id != current_user.id
+            ).order_by(fts.c.score).limit(10).all()
+        if not users:
+            # Инфикс в нике («ice» -> alice) индексы не покрывают — полный проход
+            users = User.query.filter(
+                User.id != current_user.id, User.username.ilike(f'%{query}%')
+            ).limit(10).all()
+        if not users:
+            # Опечатка: похожие ники и навыки
+            fuzzy, _ = _fuzzy_user_filter(query)
+            if fuzzy is not None:
+                users = User.query.filter(fuzzy, User.id != current_user.id).limit(10).all()
     
     results = []
     for user in users:
@@ -1413,23 +2943,439 @@ def api_search():
             'avatar_url': user.avatar_url or ''
         })
     
-    return jsonify(results)
+    # Повторные префиксы отдаёт кэш браузера, иначе 304 по ETag; ответ зависит от сессии
+    resp = jsonify(results)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = API_SEARCH_MAX_AGE
+    resp.vary.add('Cookie')
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+@app.route('/api/cache_stats')
+@login_required
+def api_cache_stats():
+    """Per-process cache counters (this worker only)."""
+    return jsonify({
+        'status': 'ok',
+        'facets': _facet_cache.stats(),
+        'counts': _count_cache.stats(),
+        'llm_responses': _llm_cache.stats(),
+        'llm_http': {f'{scheme}://{host}:{port}': pool.stats() for (scheme, host, port), pool in list(_http_pools.items())},
+    })
+
+# ===== Keyset pagination =====
+# Listings seek on (created_at, id) — served by the created_at index, whose entries
+# carry the rowid — so page N costs the same as page 1, unlike OFFSET.
+USERS_PAGE_SIZE = max(1, _env_int('USERS_PAGE_SIZE', 20))
+FREELANCE_PAGE_SIZE = max(1, _env_int('FREELANCE_PAGE_SIZE', 50))
+
+def _encode_cursor(row):
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+def _decode_cursor(value):
+    """'<iso created_at>_<id>' -> (datetime, id), None if absent or malformed."""
+    try:
+        ts, _, row_id = (value or '').rpartition('_')
+        return (datetime.fromisoformat(ts), int(row_id)) if ts else None
+    except ValueError:
+        return None
+
+class _KeysetPage:
+    def __init__(self, items, total, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.total = total
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def _keyset_page(query, model, per_page, after=None, before=None, total=None):
+    """Newest-first page of `query` strictly after (older than) or before (newer than) a cursor."""
+    key = db.tuple_(model.created_at, model.id)
+    if before:
+        rows = query.filter(key > db.tuple_(*before)).order_by(
+            model.created_at.asc(), model.id.asc()
+        ).limit(per_page + 1).all()
+        items = rows[:per_page][::-1]
+        has_prev, has_next = len(rows) > per_page, True
+    else:
+        if after:
+            query = query.filter(key < db.tuple_(*after))
+        rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_prev, has_next = after is not None, len(rows) > per_page
+    return _KeysetPage(
+        items, total,
+        next_cursor=_encode_cursor(items[-1]) if has_next and items else None,
+        prev_cursor=_encode_cursor(items[0]) if has_prev and items else None,
+    )
+
+class _CountCache:
+    """Approximate listing totals: COUNT(*) results kept per key and recomputed
+    in a background thread once older than `ttl_s` (stale-while-revalidate).
+    Only the very first read of a key counts synchronously.
+    """
+
+    def __init__(self, ttl_s, maxsize=256):
+        self.ttl_s = ttl_s
+        self._values = _LRUCache(maxsize)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def get(self, key, count):
+        entry = self._values.get(key)
+        if entry is None:
+            value = count()
+            self._values.set(key, (value, time.monotonic()))
+            return value
+        value, at = entry
+        if time.monotonic() - at >= self.ttl_s:
+            with self._lock:
+                start = key not in self._refreshing
+                self._refreshing.add(key)
+            if start:
+                threading.Thread(target=self._refresh, args=(key, count), daemon=True).start()
+        return value
+
+    def _refresh(self, key, count):
+        try:
+            with app.app_context():
+                self._values.set(key, (count(), time.monotonic()))
+                self.refreshes += 1
+        except Exception as e:
+            app.logger.warning('Count refresh failed for %s: %s', key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        return {'entries': len(self._values), 'refreshes': self.refreshes}
+
+_count_cache = _CountCache(max(1, _env_int('COUNT_CACHE_TTL', 60)))
 
 @app.route('/users')
 @login_required
 def users():
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
+    after = _decode_cursor(request.args.get('after'))
+    before = _decode_cursor(request.args.get('before'))
     
+    # Всего пользователей (без текущего) — приблизительно, из фонового кэша
+    total = max(0, _count_cache.get('users', lambda: User.query.count()) - 1)
     users_query = User.query.filter(User.id != current_user.id)
-    users = users_query.paginate(
-        page=page, 
-        per_page=per_page, 
-        error_out=False
-    )
+    users = _keyset_page(users_query, User, USERS_PAGE_SIZE, after=after, before=before, total=total)
     
     return render_template('users.html', users=users)
 
+# ===== Job -> candidate matching =====
+# Score = IDF-weighted share of the job's skills the user has, times experience and
+# goal compatibility factors. The job x user overlap is the sparse product
+# J * diag(idf) * U^T, evaluated by SQLite as one join + GROUP BY per batch of jobs.
+JOB_MATCH_K = max(1, _env_int('JOB_MATCH_K', 20))
+JOB_MATCH_TTL_HOURS = max(1, _env_int('JOB_MATCH_TTL_HOURS', 24))
+JOB_MATCH_BATCH = 200
+EXPERIENCE_FACTOR = {
+    'Новичок': 0.8, 'Junior': 0.9, 'Middle': 1.0, 'Senior': 1.1, 'Lead': 1.15, 'Архитектор': 1.15,
+}
+# 'hire' posts want people looking for projects/teams; 'work' posts want people who take someone on
+LOOKING_FOR_FACTOR = {
+    'hire': {'Команду для стартапа': 1.15, 'Партнера по проектам': 1.15},
+    'work': {'Стажера': 1.2, 'Команду для стартапа': 1.1, 'Партнера по проектам': 1.1},
+}
+# Overlap, factors and per-job top-K (window function) all run inside SQLite, so the
+# batch never materializes job x user pairs in Python
+JOB_MATCH_SQL = (
+    'WITH w AS MATERIALIZED ('
+    ' SELECT js.job_id, js.skill_id, CAST(iw.value AS REAL) AS idf'
+    ' FROM json_each(:weights) iw'
+    ' JOIN job_skill js ON js.skill_id = CAST(iw.key AS INTEGER)'
+    ' WHERE js.job_id IN (SELECT value FROM json_each(:job_ids))),'
+    ' jw AS MATERIALIZED (SELECT job_id, SUM(idf) AS total FROM w GROUP BY job_id),'
+    ' overlap AS ('
+    ' SELECT w.job_id, us.user_id, SUM(w.idf) AS ov'
+    ' FROM w JOIN user_skill us ON us.skill_id = w.skill_id'
+    ' GROUP BY w.job_id, us.user_id),'
+    ' scored AS ('
+    ' SELECT o.job_id, o.user_id,'
+    ' o.ov / jw.total * {experience} * {goal} AS score'
+    ' FROM overlap o'
+    ' JOIN jw ON jw.job_id = o.job_id'
+    ' JOIN freelance_job j ON j.id = o.job_id'
+    ' JOIN user u ON u.id = o.user_id'
+    " WHERE o.user_id != j.author_id AND u.username != 'DevBot'),"
+    ' ranked AS ('
+    ' SELECT job_id, user_id, score,'
+    ' ROW_NUMBER() OVER (PARTITION BY job_id ORDER BY score DESC, user_id) AS rn'
+    ' FROM scored)'
+    ' INSERT INTO job_match (job_id, user_id, score)'
+    ' SELECT job_id, user_id, ROUND(score, 4) FROM ranked WHERE rn <= :k'
+)
+# After a profile edit only that user is rescored: their score for every job sharing a
+# skill goes in, then those jobs are trimmed back to the top :k. Someone who drops out
+# of a job's top-K leaves a gap until the job's next full recompute (JOB_MATCH_TTL_HOURS)
+JOB_MATCH_USER_SQL = (
+    'WITH cand AS MATERIALIZED ('
+    ' SELECT DISTINCT js.job_id FROM user_skill us JOIN job_skill js ON js.skill_id = us.skill_id'
+    ' WHERE us.user_id = :user_id),'
+    ' w AS MATERIALIZED ('
+    ' SELECT js.job_id, js.skill_id, CAST(iw.value AS REAL) AS idf'
+    ' FROM cand JOIN job_skill js ON js.job_id = cand.job_id'
+    ' JOIN json_each(:weights) iw ON CAST(iw.key AS INTEGER) = js.skill_id),'
+    ' jw AS (SELECT job_id, SUM(idf) AS total FROM w GROUP BY job_id),'
+    ' overlap AS ('
+    ' SELECT w.job_id, SUM(w.idf) AS ov'
+    ' FROM w JOIN user_skill us ON us.skill_id = w.skill_id AND us.user_id = :user_id'
+    ' GROUP BY w.job_id)'
+    ' INSERT INTO job_match (job_id, user_id, score)'
+    ' SELECT o.job_id, u.id, ROUND(o.ov / jw.total * {experience} * {goal}, 4)'
+    ' FROM overlap o'
+    ' JOIN jw ON jw.job_id = o.job_id'
+    ' JOIN freelance_job j ON j.id = o.job_id'
+    ' JOIN user u ON u.id = :user_id'
+    " WHERE j.author_id != u.id AND u.username != 'DevBot'"
+)
+JOB_MATCH_TRIM_SQL = (
+    'DELETE FROM job_match WHERE rowid IN ('
+    ' SELECT rid FROM ('
+    ' SELECT m.rowid AS rid, ROW_NUMBER() OVER (PARTITION BY m.job_id ORDER BY m.score DESC, m.user_id) AS rn'
+    ' FROM job_match m WHERE m.job_id IN (SELECT job_id FROM job_match WHERE user_id = :user_id))'
+    ' WHERE rn > :k)'
+)
+
+def _factor_case(expr, factors, prefix, params):
+    """CASE expression mapping `expr` to a factor (default 1.0); values go in as bind params."""
+    whens = []
+    for i, (value, factor) in enumerate(factors.items()):
+        params[f'{prefix}{i}'], params[f'{prefix}f{i}'] = value, factor
+        whens.append(f' WHEN :{prefix}{i} THEN :{prefix}f{i}')
+    return f'(CASE {expr}{"".join(whens)} ELSE 1.0 END)' if whens else '1.0'
+
+def _match_sql(template, factor_params):
+    """Fill the experience/goal factor CASEs into a job_match SQL template."""
+    return template.format(
+        experience=_factor_case('u.experience_level', EXPERIENCE_FACTOR, 'e', factor_params),
+        goal=_factor_case("j.job_type || '|' || u.looking_for", {
+            f'{jt}|{goal}': f for jt, by_goal in LOOKING_FOR_FACTOR.items() for goal, f in by_goal.items()
+        }, 'g', factor_params),
+    )
+
+def _skill_idf(skill_ids, n_users):
+    """{skill_id: idf} from how many users list each skill."""
+    df = dict(db.session.query(UserSkill.skill_id, db.func.count()).filter(
+        UserSkill.skill_id.in_(skill_ids)
+    ).group_by(UserSkill.skill_id).all()) if skill_ids else {}
+    return {sid: math.log((n_users + 1) / (df.get(sid, 0) + 1)) + 1.0 for sid in skill_ids}
+
+def _compute_job_matches(job_ids):
+    """Recompute job_match for the given jobs in batches; commits."""
+    n_users = max(1, db.session.query(db.func.count(User.id)).scalar() or 0)
+    factor_params = {}
+    sql = _match_sql(JOB_MATCH_SQL, factor_params)
+    for i in range(0, len(job_ids), JOB_MATCH_BATCH):
+        batch = list(job_ids[i:i + JOB_MATCH_BATCH])
+        skill_ids = {sid for (sid,) in db.session.query(JobSkill.skill_id).filter(JobSkill.job_id.in_(batch)).distinct()}
+        idf = _skill_idf(skill_ids, n_users)
+
+        JobMatch.query.filter(JobMatch.job_id.in_(batch)).delete(synchronize_session=False)
+        if idf:
+            db.session.execute(db.text(sql), {
+                'weights': json.dumps({str(k): v for k, v in idf.items()}),
+                'job_ids': json.dumps(batch),
+                'k': JOB_MATCH_K,
+                **factor_params,
+            })
+        FreelanceJob.query.filter(FreelanceJob.id.in_(batch)).update(
+            {FreelanceJob.matched_at: datetime.utcnow()}, synchronize_session=False
+        )
+        db.session.commit()
+
+def _rescore_user_matches(user_id):
+    """Replace one user's job_match rows after a profile edit; one transaction (caller commits)."""
+    n_users = max(1, db.session.query(db.func.count(User.id)).scalar() or 0)
+    cand = db.select(JobSkill.job_id).join(UserSkill, UserSkill.skill_id == JobSkill.skill_id).where(
+        UserSkill.user_id == user_id
+    )
+    skill_ids = {sid for (sid,) in db.session.query(JobSkill.skill_id).filter(JobSkill.job_id.in_(cand)).distinct()}
+    factor_params = {}
+    sql = _match_sql(JOB_MATCH_USER_SQL, factor_params)
+    JobMatch.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    if skill_ids:
+        db.session.execute(db.text(sql), {
+            'user_id': user_id,
+            'weights': json.dumps({str(k): v for k, v in _skill_idf(skill_ids, n_users).items()}),
+            **factor_params,
+        })
+        db.session.execute(db.text(JOB_MATCH_TRIM_SQL), {'user_id': user_id, 'k': JOB_MATCH_K})
+
+def _job_matches(job):
+    """Top candidates for a job from job_match. A stale job is recomputed in the background;
+    the rows already there are served meanwhile."""
+    stale_before = datetime.utcnow() - timedelta(hours=JOB_MATCH_TTL_HOURS)
+    if job.matched_at is None or job.matched_at < stale_before:
+        _queue_match_refresh(job.id)
+    return JobMatch.query.filter_by(job_id=job.id).order_by(JobMatch.score.desc(), JobMatch.user_id).all()
+
+_match_refresh_pending = set()
+_match_refresh_lock = threading.Lock()
+
+def _queue_match_refresh(job_id=None, user_id=None):
+    """On the single writer thread: recompute one stale job's matches in full, or rescore
+    one user's rows after a profile edit. Repeated requests for the same target queue once."""
+    key = (job_id, user_id)
+    with _match_refresh_lock:
+        if key in _match_refresh_pending:
+            return
+        _match_refresh_pending.add(key)
+    _queue_feed_task(_refresh_job_matches, job_id, user_id)
+
+def _refresh_job_matches(job_id=None, user_id=None):
+    with _match_refresh_lock:
+        # Requests arriving from now on need another pass
+        _match_refresh_pending.discard((job_id, user_id))
+    if user_id is not None:
+        _rescore_user_matches(user_id)
+        return
+    stale_before = datetime.utcnow() - timedelta(hours=JOB_MATCH_TTL_HOURS)
+    ids = [row.id for row in db.session.query(FreelanceJob.id).filter(
+        FreelanceJob.id == job_id,
+        db.or_(FreelanceJob.matched_at.is_(None), FreelanceJob.matched_at < stale_before),
+    )]
+    if ids:
+        _compute_job_matches(ids)
+
+@app.cli.command('recompute-job-matches')
+def recompute_job_matches_command():
+    """Nightly batch: recompute job_match for every job."""
+    ids = [row.id for row in db.session.query(FreelanceJob.id).order_by(FreelanceJob.id)]
+    started = time.perf_counter()
+    _compute_job_matches(ids)
+    click.echo(f'job_match: {len(ids)} jobs in {time.perf_counter() - started:.1f}s')
+
+# ===== Job feed (fan-out on write) =====
+# Posting a job appends it to the feed of every user sharing a skill; reading a feed
+# page is one seek on ix_job_feed_user_created, however many jobs exist.
+JOB_FEED_MAX = max(10, _env_int('JOB_FEED_MAX', 200))
+JOB_FEED_PAGE_SIZE = max(1, _env_int('JOB_FEED_PAGE_SIZE', 20))
+# Recipients per fan-out transaction: bounds how long the SQLite write lock is held
+JOB_FEED_BATCH = max(1, _env_int('JOB_FEED_BATCH', 500))
+# One writer thread: fan-outs and job_match refreshes run after the request and never
+# contend with each other
+_feed_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-feed')
+
+JOB_FEED_FANOUT_SQL = (
+    'INSERT OR IGNORE INTO job_feed_item (user_id, job_id, created_at, matched)'
+    ' SELECT us.user_id, j.id, j.created_at, COUNT(*)'
+    ' FROM freelance_job j'
+    ' JOIN job_skill js ON js.job_id = j.id'
+    ' JOIN user_skill us ON us.skill_id = js.skill_id'
+    ' WHERE j.id = :job_id AND us.user_id != j.author_id'
+    ' AND us.user_id IN (SELECT value FROM json_each(:user_ids))'
+    ' GROUP BY us.user_id'
+)
+# Keep the newest JOB_FEED_MAX items of each user in the batch that just received the job
+JOB_FEED_TRIM_SQL = (
+    'DELETE FROM job_feed_item WHERE rowid IN ('
+    ' SELECT f.rowid FROM job_feed_item t'
+    ' JOIN job_feed_item f ON f.user_id = t.user_id'
+    ' WHERE t.job_id = :job_id AND t.user_id IN (SELECT value FROM json_each(:user_ids))'
+    ' AND (f.created_at, f.job_id) < ('
+    '  SELECT f2.created_at, f2.job_id FROM job_feed_item f2 WHERE f2.user_id = t.user_id'
+    '  ORDER BY f2.created_at DESC, f2.job_id DESC LIMIT 1 OFFSET :keep))'
+)
+JOB_FEED_SEED_SQL = (
+    'INSERT OR IGNORE INTO job_feed_item (user_id, job_id, created_at, matched)'
+    ' SELECT :user_id, j.id, j.created_at, COUNT(*)'
+    ' FROM user_skill us'
+    ' JOIN job_skill js ON js.skill_id = us.skill_id'
+    ' JOIN freelance_job j ON j.id = js.job_id'
+    ' WHERE us.user_id = :user_id AND j.author_id != :user_id'
+    ' GROUP BY j.id ORDER BY j.created_at DESC, j.id DESC LIMIT :cap'
+)
+
+def _run_feed_task(fn, *args):
+    try:
+        with app.app_context():
+            fn(*args)
+            db.session.commit()
+    except Exception:
+        app.logger.error('Job feed update failed:\n%s', traceback.format_exc())
+
+def _fan_out_job(job_id):
+    """Append the job to its recipients' feeds, JOB_FEED_BATCH users per transaction so other
+    writers (e.g. /send_message) get the write lock between batches."""
+    user_ids = [uid for (uid,) in db.session.query(UserSkill.user_id).join(
+        JobSkill, JobSkill.skill_id == UserSkill.skill_id
+    ).filter(JobSkill.job_id == job_id).distinct().order_by(UserSkill.user_id)]
+    db.session.commit()  # end the read transaction before the first write
+    for i in range(0, len(user_ids), JOB_FEED_BATCH):
+        params = {'job_id': job_id, 'user_ids': json.dumps(user_ids[i:i + JOB_FEED_BATCH])}
+        db.session.execute(db.text(JOB_FEED_FANOUT_SQL), params)
+        db.session.execute(db.text(JOB_FEED_TRIM_SQL), dict(params, keep=JOB_FEED_MAX - 1))
+        db.session.commit()
+
+def _reseed_feed(user_id):
+    """Rebuild one user's feed from the newest jobs matching their current skills."""
+    JobFeedItem.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    db.session.execute(db.text(JOB_FEED_SEED_SQL), {'user_id': user_id, 'cap': JOB_FEED_MAX})
+
+def _seed_all_feeds():
+    """One-time backfill for users that existed before job_feed_item, committed per batch."""
+    user_ids = [uid for (uid,) in db.session.query(UserSkill.user_id).distinct().order_by(UserSkill.user_id)]
+    for i in range(0, len(user_ids), JOB_FEED_BATCH):
+        for user_id in user_ids[i:i + JOB_FEED_BATCH]:
+            db.session.execute(db.text(JOB_FEED_SEED_SQL), {'user_id': user_id, 'cap': JOB_FEED_MAX})
+        db.session.commit()
+    if user_ids:
+        app.logger.info('Job feed backfill: seeded %d users', len(user_ids))
+
+def _backfill_feeds():
+    """Queue the feed backfill when jobs with skills exist but no feed was ever written."""
+    if db.session.query(JobFeedItem.user_id).first() is None and db.session.query(JobSkill.job_id).first() is not None:
+        _queue_feed_task(_seed_all_feeds)
+
+def _queue_feed_task(fn, *args):
+    try:
+        _feed_pool.submit(_run_feed_task, fn, *args)
+    except RuntimeError:
+        app.logger.warning('Job feed pool unavailable, skipped %s%s', fn.__name__, args)
+
+def _feed_page(user_id, after=None, limit=None):
+    """(jobs newest first, next cursor or None) for a user's feed."""
+    limit = limit or JOB_FEED_PAGE_SIZE
+    query = db.session.query(FreelanceJob).join(
+        JobFeedItem, JobFeedItem.job_id == FreelanceJob.id
+    ).filter(JobFeedItem.user_id == user_id)
+    if after:
+        query = query.filter(db.tuple_(JobFeedItem.created_at, JobFeedItem.job_id) < db.tuple_(*after))
+    rows = query.order_by(JobFeedItem.created_at.desc(), JobFeedItem.job_id.desc()).limit(limit + 1).all()
+    jobs = rows[:limit]
+    return jobs, (_encode_cursor(jobs[-1]) if len(rows) > limit else None)
+
+@app.route('/api/feed')
+@login_required
+def api_feed():
+    jobs, next_cursor = _feed_page(current_user.id, after=_decode_cursor(request.args.get('after')),
+                                   limit=max(1, min(request.args.get('limit', JOB_FEED_PAGE_SIZE, type=int), 100)))
+    return jsonify({
+        'jobs': [{
+            'id': job.id,
+            'title': job.title,
+            'skills': job.skills or '',
+            'budget': job.budget or '',
+            'job_type': job.job_type,
+            'is_remote': bool(job.is_remote),
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'url': url_for('freelance_detail', job_id=job.id),
+        } for job in jobs],
+        'next': next_cursor,
+    })
+
 # Freelance: list and search
 @app.route('/freelance')
 def freelance_list():
@@ -1438,29 +3384,52 @@ def freelance_list():
     job_type = request.args.get('type', '').strip()  # hire | work | ''
     remote = request.args.get('remote', '').strip()  # '1' or ''
 
-    jobs_query = FreelanceJob.query
-    if q:
-        like = f"%{q}%"
-        jobs_query = jobs_query.filter(
-            (FreelanceJob.title.ilike(like)) | (FreelanceJob.description.ilike(like))
-        )
-    if skill:
-        jobs_query = jobs_query.filter(FreelanceJob.skills.ilike(f"%{skill}%"))
+    # Фильтры собираются списком условий: счётчик в фоне строит по ним свой запрос
+    conds = []
     if job_type in ('hire', 'work'):
-        jobs_query = jobs_query.filter(FreelanceJob.job_type == job_type)
+        conds.append(FreelanceJob.job_type == job_type)
     if remote == '1':
-        jobs_query = jobs_query.filter(FreelanceJob.is_remote.is_(True))
-
-    jobs = jobs_query.order_by(FreelanceJob.created_at.desc()).limit(100).all()
-
-    # build available skill tags from existing jobs
-    skill_set = set()
-    for j in FreelanceJob.query.all():
-        if j.skills:
-            skill_set.update([s.strip() for s in j.skills.split(',') if s.strip()])
+        conds.append(FreelanceJob.is_remote.is_(True))
+
+    # Известный навык — точный фильтр по индексу job_skill, иначе префиксный поиск
+    skill_row = _skill_by_name(skill) if skill else None
+    if skill_row:
+        conds.append(FreelanceJob.id.in_(db.select(JobSkill.job_id).where(JobSkill.skill_id == skill_row.id)))
+    fts_skill = '' if skill_row else skill
+
+    match = _job_fts_match(q, fts_skill) if _fts_enabled('job_fts') else None
+    highlights = {}
+    page = None
+    if match and q:
+        # Текстовый запрос: ранжирование bm25 по ограниченному набору кандидатов + подсветка
+        fts = _job_fts_ranked(match)
+        jobs = FreelanceJob.query.filter(*conds).join(fts, FreelanceJob.id == fts.c.job_id).order_by(fts.c.score).limit(100).all()
+        highlights = _job_fts_highlights(match, [j.id for j in jobs])
+    else:
+        if match:
+            # Только фильтр по навыку: индексное совпадение, порядок — новые сверху
+            conds.append(FreelanceJob.id.in_(db.text('SELECT rowid FROM job_fts WHERE job_fts MATCH :m').bindparams(m=match)))
+        else:
+            if q:
+                like = f"%{q}%"
+                conds.append((FreelanceJob.title.ilike(like)) | (FreelanceJob.description.ilike(like)))
+            if fts_skill:
+                conds.append(FreelanceJob.skills.ilike(f"%{fts_skill}%"))
+        # Лента по (created_at, id) с курсором; итог — приблизительный, из фонового кэша
+        count_key = ('jobs', job_type if job_type in ('hire', 'work') else '', remote == '1',
+                     skill_row.id if skill_row else fts_skill.lower(), q.lower())
+        total = _count_cache.get(count_key, lambda: FreelanceJob.query.filter(*conds).count())
+        page = _keyset_page(FreelanceJob.query.filter(*conds), FreelanceJob, FREELANCE_PAGE_SIZE,
+                            after=_decode_cursor(request.args.get('after')),
+                            before=_decode_cursor(request.args.get('before')), total=total)
+        jobs = page.items
+
+    # skill tags with job counts (GROUP BY, cached until the next posted job)
+    all_skills = _job_facets()
 
     return render_template('freelance.html', jobs=jobs, q=q, skill_filter=skill,
-                           job_type=job_type, remote=remote, all_skills=sorted(skill_set))
+                           job_type=job_type, remote=remote, all_skills=all_skills,
+                           highlights=highlights, page=page)
 
 # Freelance: create new job
 @app.route('/freelance/new', methods=['GET', 'POST'])
@@ -1490,7 +3459,13 @@ def freelance_new():
             author_id=current_user.id
         )
         db.session.add(job)
+        _index_job(job)
         db.session.commit()
+        _facet_cache.bump('jobs')
+        for slug, name in _parse_skills(job.skills):
+            _skill_trigrams.add(slug, name)
+        _queue_feed_task(_fan_out_job, job.id)
+        _queue_match_refresh(job.id)
         flash('Вакансия опубликована!')
         return redirect(url_for('freelance_detail', job_id=job.id))
 
@@ -1500,7 +3475,9 @@ def freelance_new():
 @app.route('/freelance/<int:job_id>')
 def freelance_detail(job_id):
     job = FreelanceJob.query.get_or_404(job_id)
-    return render_template('freelance_detail.html', job=job)
+    # Подходящие разработчики (ники, навыки) — только для вошедших, как /users и /search
+    matches = _job_matches(job) if current_user.is_authenticated else []
+    return render_template('freelance_detail.html', job=job, matches=matches)
 
 @app.route('/user/<int:user_id>')
 @login_required
@@ -1509,18 +3486,13 @@ def user_profile(user_id):
     if user.id == current_user.id:
         return redirect(url_for('profile'))
     
-    # Находим похожих пользователей по навыкам
+    # Похожие пользователи: инвертированный индекс навыков, top-K по IDF-взвешенному Жаккару
     similar_users = []
     if user.skills:
-        user_skills = [skill.strip().lower() for skill in user.skills.split(',')]
-        all_users = User.query.filter(User.id != current_user.id, User.id != user.id).all()
-        
-        for other_user in all_users:
-            if other_user.skills:
-                other_skills = [skill.strip().lower() for skill in other_user.skills.split(',')]
-                # Проверяем пересечение навыков
-                if set(user_skills) & set(other_skills):
-                    similar_users.append(other_user)
+        ranked = _similar_users.top(user.id, SIMILAR_USERS_K, exclude=(current_user.id,))
+        if ranked:
+            by_id = {u.id: u for u in User.query.filter(User.id.in_([uid for uid, _ in ranked]))}
+            similar_users = [by_id[uid] for uid, _ in ranked if uid in by_id]
 
     return render_template('user_profile.html', user=user, similar_users=similar_users)
 
@@ -1549,29 +3521,171 @@ def test_css():
     </html>
     '''
 
+# chat_id -> (user1_id, user2_id); participants never change, so no invalidation needed
+_chat_members_cache = _LRUCache(_env_int('CHAT_MEMBERS_CACHE_SIZE', 10000))
+# (chat_id, user_id) -> monotonic time of the last typing broadcast
+_typing_last = _LRUCache(_env_int('TYPING_TRACK_SIZE', 10000))
+try:
+    TYPING_COALESCE_SECONDS = float(os.getenv('TYPING_COALESCE_SECONDS', '2'))
+except Exception:
+    TYPING_COALESCE_SECONDS = 2.0
+
+def _chat_members(chat_id):
+    members = _chat_members_cache.get(chat_id)
+    if members is None:
+        row = db.session.query(Chat.user1_id, Chat.user2_id).filter(Chat.id == chat_id).first()
+        if not row:
+            return ()
+        members = (row[0], row[1])
+        _chat_members_cache.set(chat_id, members)
+    return members
+
+def _socket_chat_id(data):
+    """chat_id from a socket event payload if the current user participates in that chat."""
+    try:
+        chat_id = int((data or {}).get('chat_id') or 0)
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if not chat_id or not current_user.is_authenticated:
+        return None
+    if current_user.id not in _chat_members(chat_id):
+        return None
+    return chat_id
+
+def _socket_chat(data):
+    """Chat referenced by a socket event payload if the current user participates in it."""
+    chat_id = _socket_chat_id(data)
+    return Chat.query.get(chat_id) if chat_id else None
+
 @socketio.on('join')
 def on_join(data):
-    chat_id = data.get('chat_id')
-    if not chat_id:
+    chat = _socket_chat(data)
+    if not chat:
         return
-    join_room(f"chat_{chat_id}")
+    join_room(f"chat_{chat.id}")
+    # Resume: replay what the client missed since its last acknowledged message id
+    try:
+        last_id = int(data.get('last_id'))
+    except (TypeError, ValueError):
+        last_id = None
+    if last_id is not None:
+        missed = Message.query.filter(
+            Message.chat_id == chat.id, Message.id > last_id
+        ).order_by(Message.id).limit(CHAT_PAGE_MAX + 1).all()
+        truncated = len(missed) > CHAT_PAGE_MAX
+        missed = missed[:CHAT_PAGE_MAX]
+        _mark_chat_read(chat)
+        emit('message:sync', {
+            'messages': [_message_payload(m, chat) for m in missed],
+            'last_id': missed[-1].id if missed else last_id,
+            'read_up_to': _peer_read_mark(chat, current_user.id),
+            'truncated': truncated
+        })
+
+@socketio.on('read')
+def on_read(data):
+    chat = _socket_chat(data)
+    if chat:
+        _mark_chat_read(chat)
 
 @socketio.on('leave')
 def on_leave(data):
-    chat_id = data.get('chat_id')
+    chat_id = (data or {}).get('chat_id')
     if not chat_id:
         return
     leave_room(f"chat_{chat_id}")
 
 @socketio.on('typing')
 def on_typing(data):
-    chat_id = data.get('chat_id')
-    username = data.get('username')
-    if chat_id and username:
-        emit('typing', {'username': username}, room=f"chat_{chat_id}")
+    chat_id = _socket_chat_id(data)
+    if not chat_id:
+        return
+    # Coalesce keystrokes: at most one broadcast per interval per user, whatever the number of tabs
+    key = (chat_id, current_user.id)
+    now = time.monotonic()
+    if now - _typing_last.get(key, 0.0) < TYPING_COALESCE_SECONDS:
+        return
+    _typing_last.set(key, now)
+    # Username comes from the session, not from the client
+    emit('typing', {'username': current_user.username, 'user_id': current_user.id},
+         room=f"chat_{chat_id}", include_self=False)
+
+def _migrate_schema():
+    """Upgrade an existing SQLite file in place after db.create_all().
+
+    create_all() only creates missing tables, so columns and indexes added to
+    models later are applied here. Safe to run on every start.
+    """
+    engine = db.engine
+    inspector = db.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = set()
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            have = {c['name'] for c in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in have:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col.type.compile(dialect=engine.dialect)}'
+                if col.server_default is not None:
+                    arg = col.server_default.arg
+                    ddl += ' DEFAULT ' + (arg.text if hasattr(arg, 'text') else f"'{arg}'")
+                conn.exec_driver_sql(ddl)
+                added.add(f"{table.name}.{col.name}")
+                app.logger.info('Schema migration: added column %s.%s', table.name, col.name)
+        # Pair key must be filled before ux_chat_pair is created; legacy duplicates keep NULL
+        conn.exec_driver_sql(
+            'UPDATE chat SET pair_lo = MIN(user1_id, user2_id), pair_hi = MAX(user1_id, user2_id)'
+            ' WHERE pair_lo IS NULL AND id = ('
+            ' SELECT MIN(c2.id) FROM chat c2'
+            ' WHERE MIN(c2.user1_id, c2.user2_id) = MIN(chat.user1_id, chat.user2_id)'
+            ' AND MAX(c2.user1_id, c2.user2_id) = MAX(chat.user1_id, chat.user2_id))'
+            ' AND NOT EXISTS (SELECT 1 FROM chat c3 WHERE c3.pair_lo = MIN(chat.user1_id, chat.user2_id)'
+            ' AND c3.pair_hi = MAX(chat.user1_id, chat.user2_id))'
+        )
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    _backfill_chat_summaries(added)
+    _backfill_skills()
+    _ensure_fts()
+    _backfill_feeds()
+
+def _backfill_chat_summaries(added=()):
+    """Fill inbox summary and read watermark columns for chats created before they existed."""
+    with db.engine.begin() as conn:
+        if 'chat.last_read_user1' in added:
+            # Seed watermarks from the legacy per-message is_read flags
+            for side in ('user1', 'user2'):
+                conn.exec_driver_sql(
+                    f'UPDATE chat SET last_read_{side} = COALESCE(('
+                    f' SELECT MAX(m.id) FROM message m WHERE m.chat_id = chat.id'
+                    f' AND m.sender_id != chat.{side}_id AND m.is_read), 0)'
+                )
+        conn.exec_driver_sql(
+            'UPDATE chat SET last_message_id = ('
+            ' SELECT m.id FROM message m WHERE m.chat_id = chat.id'
+            ' ORDER BY m.timestamp DESC, m.id DESC LIMIT 1)'
+            ' WHERE last_message_id IS NULL'
+            ' AND EXISTS (SELECT 1 FROM message m WHERE m.chat_id = chat.id)'
+        )
+        conn.exec_driver_sql(
+            'UPDATE chat SET'
+            ' last_message_preview = (SELECT substr(m.content, 1, 120) FROM message m WHERE m.id = chat.last_message_id),'
+            ' last_sender_id = (SELECT m.sender_id FROM message m WHERE m.id = chat.last_message_id),'
+            ' unread_user1 = (SELECT COUNT(*) FROM message m WHERE m.chat_id = chat.id'
+            '   AND m.sender_id != chat.user1_id AND m.id > chat.last_read_user1),'
+            ' unread_user2 = (SELECT COUNT(*) FROM message m WHERE m.chat_id = chat.id'
+            '   AND m.sender_id != chat.user2_id AND m.id > chat.last_read_user2)'
+            ' WHERE last_message_id IS NOT NULL AND last_sender_id IS NULL'
+        )
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        _migrate_schema()
         get_or_create_ai_user()
+    _warm_indexes()
     socketio.run(app, debug=True)
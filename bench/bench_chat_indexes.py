@@ -0,0 +1,157 @@
+"""Scan vs seek benchmark for the chat/freelance hot queries.
+
+Seeds a throwaway SQLite file with the app's schema (tables only, no indexes),
+times the queries used by chat(), chats(), get_messages and freelance_list,
+then creates the model indexes and times them again.
+
+Usage:
+    python bench/bench_chat_indexes.py                 # 1M messages
+    python bench/bench_chat_indexes.py --messages 200000 --keep /tmp/bench.db
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy.dialects import sqlite as sqlite_dialect  # noqa: E402
+from sqlalchemy.schema import CreateIndex, CreateTable  # noqa: E402
+
+from app import db  # noqa: E402
+
+
+def _ddl(element):
+    return str(element.compile(dialect=sqlite_dialect.dialect())).strip()
+
+
+def create_schema(conn):
+    for table in db.metadata.sorted_tables:
+        conn.execute(_ddl(CreateTable(table)))
+
+
+def create_indexes(conn):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(_ddl(CreateIndex(index)))
+    conn.execute('ANALYZE')
+
+
+def seed(conn, n_users, n_chats, n_messages, n_jobs):
+    rnd = random.Random(42)
+    base = datetime(2024, 1, 1)
+    conn.executemany(
+        'INSERT INTO user (id, username, email, password_hash, created_at) VALUES (?, ?, ?, ?, ?)',
+        ((i, f'user{i}', f'user{i}@example.com', 'x', base) for i in range(1, n_users + 1)),
+    )
+    pairs = set()
+    while len(pairs) < n_chats:
+        a, b = rnd.randint(1, n_users), rnd.randint(1, n_users)
+        if a != b:
+            pairs.add((min(a, b), max(a, b)))
+    chats = list(pairs)
+    conn.executemany(
+        'INSERT INTO chat (id, user1_id, user2_id, created_at, last_message_at) VALUES (?, ?, ?, ?, ?)',
+        ((i, a, b, base, base) for i, (a, b) in enumerate(chats, start=1)),
+    )
+
+    def messages():
+        for i in range(1, n_messages + 1):
+            chat_id = rnd.randint(1, n_chats)
+            a, b = chats[chat_id - 1]
+            yield (i, chat_id, a if i % 2 else b, f'message {i}', base + timedelta(seconds=i), i % 3 == 0)
+
+    conn.executemany(
+        'INSERT INTO message (id, chat_id, sender_id, content, timestamp, is_read) VALUES (?, ?, ?, ?, ?, ?)',
+        messages(),
+    )
+    conn.executemany(
+        'INSERT INTO freelance_job (id, title, description, job_type, is_remote, author_id, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        ((i, f'Job {i}', 'desc', 'hire', 1, rnd.randint(1, n_users), base + timedelta(minutes=i))
+         for i in range(1, n_jobs + 1)),
+    )
+    conn.commit()
+    return chats
+
+
+def queries(chats, n_chats, n_messages):
+    rnd = random.Random(7)
+    sample = [rnd.randint(1, n_chats) for _ in range(50)]
+    return [
+        ('chat(): find chat by pair',
+         'SELECT id FROM chat WHERE (user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?) LIMIT 1',
+         [(a, b, b, a) for a, b in (chats[c - 1] for c in sample)]),
+        ('chats(): list by participant',
+         'SELECT id FROM chat WHERE user1_id = ? OR user2_id = ? ORDER BY last_message_at DESC',
+         [(chats[c - 1][0], chats[c - 1][0]) for c in sample]),
+        ('get_messages: newest page',
+         'SELECT id FROM message WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT 51',
+         [(c,) for c in sample]),
+        ('get_messages: delta since_id',
+         'SELECT id FROM message WHERE chat_id = ? AND id > ? ORDER BY id LIMIT 201',
+         [(c, n_messages // 2) for c in sample]),
+        ('freelance_list: newest jobs',
+         'SELECT id FROM freelance_job ORDER BY created_at DESC LIMIT 100',
+         [()] * 50),
+    ]
+
+
+def run(conn, cases):
+    results = {}
+    for name, sql, params in cases:
+        plan = ' | '.join(r[-1] for r in conn.execute('EXPLAIN QUERY PLAN ' + sql, params[0]))
+        start = time.perf_counter()
+        for p in params:
+            conn.execute(sql, p).fetchall()
+        per_q = (time.perf_counter() - start) / len(params) * 1000
+        results[name] = (per_q, plan)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--messages', type=int, default=1_000_000)
+    ap.add_argument('--users', type=int, default=20_000)
+    ap.add_argument('--chats', type=int, default=50_000)
+    ap.add_argument('--jobs', type=int, default=100_000)
+    ap.add_argument('--keep', help='write the DB to this path instead of a temp file')
+    args = ap.parse_args()
+
+    path = args.keep or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    create_schema(conn)
+    t0 = time.perf_counter()
+    chats = seed(conn, args.users, args.chats, args.messages, args.jobs)
+    print(f'seeded {args.messages} messages / {args.chats} chats / {args.jobs} jobs '
+          f'in {time.perf_counter() - t0:.1f}s -> {path}')
+
+    cases = queries(chats, args.chats, args.messages)
+    before = run(conn, cases)
+    t0 = time.perf_counter()
+    create_indexes(conn)
+    print(f'created indexes in {time.perf_counter() - t0:.1f}s\n')
+    after = run(conn, cases)
+
+    print(f"{'query':34} {'no index ms':>12} {'indexed ms':>12} {'speedup':>9}")
+    for name, _, _ in cases:
+        b, a = before[name][0], after[name][0]
+        print(f'{name:34} {b:12.3f} {a:12.3f} {b / a if a else float("inf"):8.0f}x')
+    print('\nquery plans (before -> after):')
+    for name, _, _ in cases:
+        print(f'- {name}\n    {before[name][1]}\n    {after[name][1]}')
+    conn.close()
+    if not args.keep:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
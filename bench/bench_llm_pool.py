@@ -0,0 +1,124 @@
+"""Per-request urlopen vs pooled keep-alive connections to an LLM-like HTTPS endpoint.
+
+Starts a local HTTPS stand-in for the provider (self-signed certificate made
+with the openssl CLI) that answers /chat/completions with a canned
+completion, then sends the same requests through a fresh urlopen connection
+each time (the old _http_post_json) and through app._HTTPPool.
+
+Usage:
+    python bench/bench_llm_pool.py                      # 200 requests
+    python bench/bench_llm_pool.py --requests 500 --rtt-ms 20
+"""
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import _HTTPPool, _http_post_json  # noqa: E402
+
+COMPLETION = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': 'ok'}}]}).encode('utf-8')
+
+
+def make_cert(directory):
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+         '-keyout', key, '-out', cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+class RTTSocketServer(ThreadingHTTPServer):
+    """Adds one simulated network round trip per new connection (TCP handshake)."""
+    daemon_threads = True
+    connect_rtt_s = 0.0
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        if self.connect_rtt_s:
+            time.sleep(self.connect_rtt_s)
+        return sock, addr
+
+
+def start_server(cert, key, rtt_s):
+    server = RTTSocketServer(('127.0.0.1', 0), Handler)
+    server.connect_rtt_s = rtt_s
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_urlopen(url, payload, n, ctx):
+    body = json.dumps(payload).encode('utf-8')
+    start = time.perf_counter()
+    for _ in range(n):
+        req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(req, timeout=20, context=ctx) as resp:
+            json.loads(resp.read())
+    return (time.perf_counter() - start) / n * 1000
+
+
+def bench_pool(url, payload, n, ctx, port):
+    pool = _HTTPPool('https', '127.0.0.1', port, ssl_context=ctx)
+    start = time.perf_counter()
+    for _ in range(n):
+        _http_post_json(url, {'Content-Type': 'application/json'}, payload, pool=pool)
+    return (time.perf_counter() - start) / n * 1000, pool.stats()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--requests', type=int, default=200)
+    ap.add_argument('--rtt-ms', type=float, default=0.0,
+                    help='simulated extra latency per new connection, e.g. 20 for a remote provider')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_cert(tmp)
+        server = start_server(cert, key, args.rtt_ms / 1000)
+        port = server.server_address[1]
+        url = f'https://127.0.0.1:{port}/chat/completions'
+        ctx = ssl.create_default_context(cafile=cert)
+        payload = {'model': 'stand-in', 'messages': [{'role': 'user', 'content': 'привет'}], 'max_tokens': 16}
+
+        fresh = bench_urlopen(url, payload, args.requests, ctx)
+        pooled, stats = bench_pool(url, payload, args.requests, ctx, port)
+        server.shutdown()
+
+    print(f'{args.requests} requests, simulated connect RTT {args.rtt_ms:.0f} ms')
+    print(f'  urlopen per request : {fresh:8.2f} ms/request ({args.requests} TCP+TLS handshakes)')
+    print(f'  pooled keep-alive   : {pooled:8.2f} ms/request ({stats["opened"]} handshake(s))')
+    print(f'  saved per request   : {fresh - pooled:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Typeahead latency: leading-wildcard LIKE vs the FTS5 user index.
+
+Seeds a throwaway SQLite file with N users (default 500k), builds user_fts with
+the app's DDL and times the /api/search query shapes for a set of prefixes.
+
+Usage:
+    python bench/bench_user_search.py
+    python bench/bench_user_search.py --users 100000
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import USER_FTS_CANDIDATES, USER_FTS_DDL, USER_FTS_NAME_HITS, USER_FTS_RANK_SQL, _fts_match_expr  # noqa: E402
+
+SKILLS = ['Python', 'JavaScript', 'React', 'Flask', 'Django', 'Go', 'Rust', 'SQL', 'Docker', 'Kotlin',
+          'Swift', 'TypeScript', 'Vue', 'Node.js', 'C++', 'Java', 'PHP', 'Ruby', 'Scala', 'Elixir']
+PREFIXES = ['al', 'max', 'dev', 'pyth', 'jo', 'ser', 'kat', 'rust', 'an', 'mi']
+
+
+def seed(conn, n):
+    rnd = random.Random(1)
+    syll = ['al', 'ex', 'max', 'dev', 'jo', 'hn', 'ser', 'gey', 'kat', 'ya', 'an', 'na', 'mi', 'ke', 'ol', 'ga']
+    conn.execute('CREATE TABLE user (id INTEGER PRIMARY KEY, username TEXT UNIQUE, bio TEXT, skills TEXT)')
+
+    def rows():
+        for i in range(1, n + 1):
+            name = ''.join(rnd.choice(syll) for _ in range(rnd.randint(2, 4))) + str(i)
+            bio = ' '.join(''.join(rnd.choice(string.ascii_lowercase) for _ in range(6)) for _ in range(8))
+            yield i, name, bio, ', '.join(rnd.sample(SKILLS, 3))
+
+    conn.executemany('INSERT INTO user VALUES (?, ?, ?, ?)', rows())
+    conn.commit()
+
+
+def bench(conn, sql, params_list, repeat=5):
+    best = []
+    for params in params_list:
+        t = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            t.append(time.perf_counter() - start)
+        best.append(min(t) * 1000)
+    return sum(best) / len(best), max(best)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--users', type=int, default=500_000)
+    args = ap.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_users.db')
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    t0 = time.perf_counter()
+    seed(conn, args.users)
+    conn.execute(USER_FTS_DDL)
+    conn.execute("INSERT INTO user_fts (rowid, username, bio, skills) SELECT id, username, bio, skills FROM user")
+    conn.commit()
+    print(f'seeded {args.users} users + FTS index in {time.perf_counter() - t0:.1f}s')
+
+    like_sql = "SELECT id FROM user WHERE id != 1 AND username LIKE ? LIMIT 10"
+    # Name-prefix hits as the app's _username_index returns them, looked up outside the timing
+    keys = sorted((name.lower(), uid) for uid, name in conn.execute('SELECT id, username FROM user'))
+
+    def name_hits(prefix):
+        i = bisect.bisect_left(keys, (prefix,))
+        return [uid for name, uid in keys[i:i + USER_FTS_NAME_HITS] if name.startswith(prefix)]
+
+    rank_sql = USER_FTS_RANK_SQL.replace(':k', str(USER_FTS_CANDIDATES))
+    fts_sql = ('SELECT u.id FROM user u JOIN (' + rank_sql +
+               ') f ON u.id = f.user_id WHERE u.id != 1 ORDER BY f.score LIMIT 10')
+    like = bench(conn, like_sql, [(f'%{p}%',) for p in PREFIXES])
+    fts = bench(conn, fts_sql, [{'m': _fts_match_expr(p), 'names': json.dumps(name_hits(p))} for p in PREFIXES])
+    print(f"{'query':22} {'avg ms':>8} {'max ms':>8}")
+    print(f"{'LIKE %q%':22} {like[0]:8.2f} {like[1]:8.2f}")
+    print(f"{'FTS5 prefix + bm25':22} {fts[0]:8.2f} {fts[1]:8.2f}")
+    conn.close()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Cross-process Socket.IO fan-out over a shared SQLite file.
+
+`SQLiteBusManager` is a python-socketio `PubSubManager` backend, i.e. the same
+interface `RedisManager` / `KombuManager` implement: `_publish()` appends a
+message, `_listen()` yields messages published by any process. Every worker on
+the host attaches to the same bus file, so `socketio.emit(..., room=...)` from
+one process reaches clients connected to another.
+
+The bus is an append-only table polled by each listener (default every 50 ms);
+rows older than `retention_s` are trimmed by publishers. It needs no extra
+service, which makes it a fit for a single host. For several hosts switch
+SOCKETIO_MESSAGE_QUEUE to a redis:// URL, no code changes required.
+
+Note: with more than one worker the load balancer must use sticky sessions,
+as required by Engine.IO for the long-polling transport.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import socketio
+
+
+class SQLiteBusManager(socketio.PubSubManager):
+    name = 'sqlitebus'
+
+    def __init__(self, url='sqlite:///socketio_bus.db', channel='flask-socketio',
+                 write_only=False, logger=None, json=None,
+                 poll_interval=0.05, retention_s=60):
+        path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else url
+        if not path:
+            raise ValueError('SQLiteBusManager needs a file path, e.g. sqlite:////tmp/bus.db')
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self.retention_s = retention_s
+        self._local = threading.local()
+        self._last_trim = 0.0
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self._ensure_schema()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _conn(self):
+        # One connection per publishing thread; sqlite3 connections aren't thread-safe
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _ensure_schema(self):
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._conn().execute(
+            'CREATE TABLE IF NOT EXISTS socketio_bus ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' channel TEXT NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' created REAL NOT NULL)'
+        )
+
+    def _publish(self, data):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('INSERT INTO socketio_bus (channel, payload, created) VALUES (?, ?, ?)',
+                     (self.channel, self.json.dumps(data), now))
+        if now - self._last_trim > self.retention_s:
+            self._last_trim = now
+            conn.execute('DELETE FROM socketio_bus WHERE created < ?', (now - self.retention_s,))
+
+    def _listen(self):
+        conn = self._connect()
+        # Only deliver what is published after this process subscribed
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_bus').fetchone()[0]
+        while True:
+            try:
+                rows = conn.execute(
+                    'SELECT id, payload FROM socketio_bus WHERE id > ? AND channel = ? ORDER BY id',
+                    (last_id, self.channel)
+                ).fetchall()
+            except sqlite3.OperationalError as exc:
+                self._get_logger().error('SQLite bus read failed: %s', exc)
+                time.sleep(1)
+                continue
+            for row_id, payload in rows:
+                last_id = row_id
+                yield payload
+            if not rows:
+                time.sleep(self.poll_interval)
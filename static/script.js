@@ -30,7 +30,13 @@ class DevConnect {
     constructor() {
         this.socket = null;
         this.messageIds = new Set();
+        this.lastMessageId = 0;
+        this.oldestMessageId = 0;
+        this.loadingOlder = false;
         this.typingTimer = null;
+        this.polling = false;
+        this.pollTimer = null;
+        this.pollDelay = 3000;
         this.init();
     }
 
@@ -368,10 +374,26 @@ class DevConnect {
         const messageInput = document.getElementById('message-input');
         const chatId = document.getElementById('chat-id')?.value;
         const root = document.querySelector('[data-user-id]');
-        const username = root?.dataset.username;
 
         if (!chatId) return;
 
+        // Курсор для дельта-синхронизации: id последнего отрисованного сообщения
+        messagesContainer.querySelectorAll('[data-message-id]').forEach(el => {
+            const id = parseInt(el.dataset.messageId);
+            if (!isNaN(id)) {
+                this.messageIds.add(id);
+                this.lastMessageId = Math.max(this.lastMessageId, id);
+                this.oldestMessageId = this.oldestMessageId ? Math.min(this.oldestMessageId, id) : id;
+            }
+        });
+
+        // Подгрузка более ранних сообщений при прокрутке вверх
+        messagesContainer.addEventListener('scroll', () => {
+            if (messagesContainer.scrollTop < 80) {
+                this.loadOlderMessages(chatId);
+            }
+        });
+
         // Автопрокрутка к последнему сообщению
         this.scrollToBottom(messagesContainer);
 
@@ -409,53 +431,95 @@ class DevConnect {
             });
 
             // Эмитим "печатает" при вводе
+            // Имя берётся сервером из сессии; сервер также схлопывает частые события
             const emitTyping = this.throttle(() => {
-                if (this.socket && username) {
-                    this.socket.emit('typing', { chat_id: parseInt(chatId), username });
+                if (this.socket && this.socket.connected) {
+                    this.socket.emit('typing', { chat_id: parseInt(chatId) });
                 }
             }, 1000);
             messageInput.addEventListener('input', emitTyping);
         }
 
-        // Автообновление сообщений
-        this.startMessagePolling(chatId);
-
-        // Подключение Socket.IO
+        // Подключение Socket.IO — основной транспорт; поллинг только как запасной режим
+        let socketStarted = false;
         if (window.io) {
             try {
                 this.socket = window.io({ transports: ['websocket', 'polling'] });
-                // Вступаем в комнату чата
-                this.socket.emit('join', { chat_id: parseInt(chatId) });
+                // При каждом (пере)подключении вступаем в комнату и догоняем пропущенное с lastMessageId
+                this.socket.on('connect', () => {
+                    this.stopMessagePolling();
+                    this.socket.emit('join', { chat_id: parseInt(chatId), last_id: this.lastMessageId });
+                });
+                this.socket.on('disconnect', () => this.startMessagePolling(chatId));
+                this.socket.on('connect_error', () => this.startMessagePolling(chatId));
+
+                // Досинхронизация после (пере)подключения
+                this.socket.on('message:sync', (data) => {
+                    this.applyMessageBatch(data);
+                    if (data && data.truncated) this.loadMessages(chatId);
+                });
+
+                // Подтверждение прочтения входящих (не чаще раза в секунду)
+                const ackRead = this.throttle(() => {
+                    if (this.socket && this.socket.connected) {
+                        this.socket.emit('read', { chat_id: parseInt(chatId) });
+                    }
+                }, 1000);
 
                 // Получаем новые сообщения в реальном времени
                 this.socket.on('message:new', (msg) => {
                     if (!msg || typeof msg.id === 'undefined') return;
-                    if (this.messageIds.has(msg.id)) return;
-                    this.messageIds.add(msg.id);
-                    this.addMessageToChat(msg);
+                    // addMessageToChat сам отсекает дубликаты по id
+                    if (!this.addMessageToChat(msg)) return;
+                    if (msg.sender_id !== parseInt(root?.dataset.userId || 0)) {
+                        this.hideTypingIndicator();
+                        ackRead();
+                    }
                     if (messagesContainer) this.scrollToBottom(messagesContainer);
                 });
 
+                // Квитанции о прочтении
+                this.socket.on('message:read', (data) => {
+                    if (!data || typeof data.up_to_id !== 'number') return;
+                    if (data.reader_id === parseInt(root?.dataset.userId || 0)) return;
+                    this.markOwnRead(data.up_to_id);
+                });
+
                 // Индикатор набора
-                const typingEl = document.getElementById('typing-indicator');
                 this.socket.on('typing', (data) => {
-                    if (!typingEl || !data || !data.username) return;
-                    typingEl.textContent = `${data.username} печатает...`;
-                    typingEl.style.display = 'block';
-                    clearTimeout(this.typingTimer);
-                    this.typingTimer = setTimeout(() => {
-                        typingEl.style.display = 'none';
-                    }, 2000);
+                    if (!data || !data.username) return;
+                    // Сервер шлёт не чаще раза в 2с — держим индикатор чуть дольше интервала
+                    this.showTypingIndicator(data.username, 3000);
                 });
 
                 // Покидаем комнату при закрытии
                 window.addEventListener('beforeunload', () => {
                     try { this.socket.emit('leave', { chat_id: parseInt(chatId) }); } catch (_) {}
                 });
+                socketStarted = true;
             } catch (e) {
                 console.warn('Socket.IO connection failed, fallback to polling only');
             }
         }
+        if (!socketStarted) {
+            this.startMessagePolling(chatId);
+        }
+    }
+
+    // Индикатор "печатает..."
+    showTypingIndicator(username, timeoutMs) {
+        const typingEl = document.getElementById('typing-indicator');
+        if (!typingEl) return;
+        typingEl.textContent = `${username} печатает...`;
+        typingEl.style.display = 'block';
+        clearTimeout(this.typingTimer);
+        this.typingTimer = setTimeout(() => this.hideTypingIndicator(), timeoutMs);
+    }
+
+    hideTypingIndicator() {
+        const typingEl = document.getElementById('typing-indicator');
+        clearTimeout(this.typingTimer);
+        if (typingEl) typingEl.style.display = 'none';
     }
 
     // Отправка сообщения
@@ -497,6 +561,10 @@ class DevConnect {
                     // fallback: только отправленное сообщение
                     this.addMessageToChat(data.message);
                 }
+                // Ответ DevBot придёт позже через сокет/поллинг
+                if (data.bot_pending) {
+                    this.showTypingIndicator('DevBot', 60000);
+                }
                 // Прокрутка вниз
                 const messagesContainer = document.getElementById('messages-container');
                 if (messagesContainer) this.scrollToBottom(messagesContainer);
@@ -507,30 +575,82 @@ class DevConnect {
         }
     }
 
-    // Загрузка сообщений
+    // Загрузка сообщений (только новые после lastMessageId). Возвращает число новых
     async loadMessages(chatId) {
+        let added = 0;
+        let since = this.lastMessageId;
         try {
-            const response = await fetch(`/get_messages/${chatId}`);
-            const messages = await response.json();
-            
-            const messagesContainer = document.getElementById('messages-container');
-            messagesContainer.innerHTML = '';
-            // Полный ререндер: сбрасываем множество, чтобы не мешало отрисовке
-            this.messageIds = new Set();
-            
-            messages.forEach(msg => {
-                // Во время периодической подгрузки НЕ анимируем
-                this.addMessageToChat(msg, /*skipDedup*/ true, /*animate*/ false);
-            });
-            
-            this.scrollToBottom(messagesContainer);
+            // Сервер отдаёт не больше страницы за раз: догружаем, пока есть has_more
+            for (;;) {
+                const response = await fetch(`/get_messages/${chatId}?since_id=${since}`);
+                const data = await response.json();
+                added += this.applyMessageBatch(data);
+                if (!data.has_more || !(data.last_id > since)) break;
+                since = data.last_id;
+            }
         } catch (error) {
             console.error('Error loading messages:', error);
         }
+        return added;
+    }
+
+    // Применить пачку сообщений из дельты (поллинг или message:sync)
+    applyMessageBatch(data) {
+        if (!data || !Array.isArray(data.messages)) return 0;
+
+        const messagesContainer = document.getElementById('messages-container');
+        // Во время подгрузки НЕ анимируем
+        const added = data.messages.filter(msg => this.addMessageToChat(msg, /*skipDedup*/ false, /*animate*/ false));
+        if (added.length) {
+            this.scrollToBottom(messagesContainer);
+            const me = parseInt(document.querySelector('[data-user-id]')?.dataset.userId || 0);
+            if (added.some(m => m.sender_id !== me)) this.hideTypingIndicator();
+        }
+        if (typeof data.read_up_to === 'number') {
+            this.markOwnRead(data.read_up_to);
+        }
+        return added.length;
+    }
+
+    // Загрузка предыдущей страницы истории (keyset по before_id)
+    async loadOlderMessages(chatId) {
+        const messagesContainer = document.getElementById('messages-container');
+        if (!messagesContainer || this.loadingOlder || !this.oldestMessageId) return;
+        if (messagesContainer.dataset.hasMore !== '1') return;
+        this.loadingOlder = true;
+        try {
+            const response = await fetch(`/get_messages/${chatId}?before_id=${this.oldestMessageId}`);
+            const data = await response.json();
+            if (!data || !Array.isArray(data.messages)) return;
+
+            // Сохраняем позицию прокрутки при вставке сверху
+            const prevHeight = messagesContainer.scrollHeight;
+            const anchor = messagesContainer.firstChild;
+            data.messages.forEach(msg => {
+                const el = this.addMessageToChat(msg, false, false, /*detached*/ true);
+                if (el) messagesContainer.insertBefore(el, anchor);
+            });
+            messagesContainer.scrollTop += messagesContainer.scrollHeight - prevHeight;
+            messagesContainer.dataset.hasMore = data.has_more ? '1' : '0';
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+        } finally {
+            this.loadingOlder = false;
+        }
+    }
+
+    // Отметить свои сообщения прочитанными до указанного id
+    markOwnRead(upToId) {
+        if (!upToId) return;
+        document.querySelectorAll('#messages-container .message.own[data-message-id]').forEach(el => {
+            if (parseInt(el.dataset.messageId) <= upToId) {
+                el.classList.add('read');
+            }
+        });
     }
 
     // Добавление сообщения в чат
-    addMessageToChat(message, skipDedup = false, animate = false) {
+    addMessageToChat(message, skipDedup = false, animate = false, detached = false) {
         const messagesContainer = document.getElementById('messages-container');
         const isOwn = message.sender_id === parseInt(document.querySelector('[data-user-id]')?.dataset.userId || 0);
         
@@ -539,8 +659,16 @@ class DevConnect {
             this.messageIds.add(message.id);
         }
 
+        if (typeof message.id === 'number') {
+            this.lastMessageId = Math.max(this.lastMessageId, message.id);
+            this.oldestMessageId = this.oldestMessageId ? Math.min(this.oldestMessageId, message.id) : message.id;
+        }
+
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${isOwn ? 'own' : ''}`;
+        if (typeof message.id !== 'undefined') {
+            messageDiv.dataset.messageId = message.id;
+        }
         messageDiv.innerHTML = `
             <div class="message-content">
                 ${this.escapeHtml(message.content)}
@@ -550,7 +678,12 @@ class DevConnect {
         if (animate) {
             messageDiv.classList.add('msg-appear');
         }
+        if (detached) {
+            // Вставку выполняет вызывающий код (например, в начало списка)
+            return messageDiv;
+        }
         messagesContainer.appendChild(messageDiv);
+        return messageDiv;
     }
 
     // Одноразовая анимация сообщений при загрузке страницы чата
@@ -575,11 +708,25 @@ class DevConnect {
         container.scrollTop = container.scrollHeight;
     }
 
-    // Автообновление сообщений
+    // Запасной поллинг, пока сокет недоступен: 3с, при тишине интервал растёт до 30с
     startMessagePolling(chatId) {
-        setInterval(() => {
-            this.loadMessages(chatId);
-        }, 3000);
+        if (this.polling) return;
+        this.polling = true;
+        this.pollDelay = 3000;
+        const tick = async () => {
+            if (!this.polling) return;
+            const got = await this.loadMessages(chatId);
+            if (!this.polling) return;
+            this.pollDelay = got ? 3000 : Math.min(this.pollDelay * 2, 30000);
+            this.pollTimer = setTimeout(tick, this.pollDelay);
+        };
+        this.pollTimer = setTimeout(tick, this.pollDelay);
+    }
+
+    stopMessagePolling() {
+        this.polling = false;
+        clearTimeout(this.pollTimer);
+        this.pollTimer = null;
     }
 
     // Создание переключателя темы
@@ -734,6 +881,10 @@ const additionalStyles = `
 .message.msg-appear .message-content {
     animation: msgIn 0.35s ease-out both;
 }
+
+.message.own.read .message-time::after {
+    content: ' \u2713\u2713';
+}
 `;
 
 // Добавляем дополнительные стили